@@ -33,6 +33,8 @@ const io = new Server(server, {
     },
 });
 
+// Пачки ЧП от Python-монитора больше лимита по умолчанию (100kb); общий парсер ниже такое тело пропускает
+app.use("/emergency/batch", express.json({ limit: "5mb" }));
 app.use(express.json());
 app.use(express.urlencoded({ extended: true }));
 app.use(
@@ -120,11 +122,14 @@ io.on("connection", (socket) => {
     });
 });
 
+const isValidEmergency = (emergencyData: any) =>
+    !!emergencyData && typeof emergencyData === "object" && !!emergencyData.title && !!emergencyData.body;
+
 app.post("/emergency", catchErrors(async (req, res, next) => {
     const emergencyData = req.body;
 
     // Валидация данных
-    if (!emergencyData || typeof emergencyData !== "object" || !emergencyData.title || !emergencyData.body) {
+    if (!isValidEmergency(emergencyData)) {
         console.error("Некорректные данные о ЧП:", emergencyData);
         return res.status(400).json({ status: "error", message: "Некорректные данные о ЧП" });
     }
@@ -140,6 +145,34 @@ app.post("/emergency", catchErrors(async (req, res, next) => {
     });
 }));
 
+// Пачка ЧП от Python-монитора: некорректные записи возвращаются в rejected и не ретраятся
+app.post("/emergency/batch", catchErrors(async (req, res, next) => {
+    const emergencies = req.body?.emergencies;
+
+    if (!Array.isArray(emergencies)) {
+        console.error("Некорректная пачка ЧП:", req.body);
+        return res.status(400).json({ status: "error", message: "Ожидается массив emergencies" });
+    }
+
+    const rejected: number[] = [];
+    emergencies.forEach((emergencyData, index) => {
+        if (!isValidEmergency(emergencyData)) {
+            console.error("Некорректные данные о ЧП:", emergencyData);
+            rejected.push(index);
+            return;
+        }
+        io.emit("emergencyUpdate", emergencyData);
+    });
+
+    console.log(`Получена пачка ЧП от Python: ${emergencies.length - rejected.length} принято, ${rejected.length} отклонено`);
+
+    return res.status(OK).json({
+        status: "success",
+        accepted: emergencies.length - rejected.length,
+        rejected,
+    });
+}));
+
 app.get("/", catchErrors(async (req, res, next) => {
     return res.status(OK).json({
         status: "working",
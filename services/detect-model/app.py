@@ -1,97 +1,241 @@
 import asyncio
 import os
-import shutil
+import threading
+import uuid
 import cv2
 import numpy as np
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
 from concurrent.futures import ThreadPoolExecutor
 from tempfile import NamedTemporaryFile
 from typing import List
-from ultralytics import YOLO
+from inference import InferenceEngine
+from motion import MotionGate
+from metrics import MEDIA_STAGE_SECONDS, render, timed
+from video_pipeline import process_video_parallel, video_info
 
 app = FastAPI()
 app.mount("/media", StaticFiles(directory="processed_media"), name="media")
 
-model_firesmoke = YOLO("firesmoke.pt")
-model_gun = YOLO("gunonly.pt")
-model_total = YOLO("total.pt")
+BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", 8))
+VIDEO_MODE = os.environ.get("VIDEO_MODE", "parallel")  # parallel — пул процессов, serial — в этом процессе
+VIDEO_WORKERS = int(os.environ.get("VIDEO_WORKERS", os.cpu_count() or 4))
+VIDEO_STRIDE = int(os.environ.get("VIDEO_STRIDE", 1))
+
+engine = InferenceEngine.from_files(batch_size=BATCH_SIZE)
+# YOLO-предиктор не потокобезопасен, а задачи JOB_CONCURRENCY идут в пуле потоков одновременно.
+# Декодирование и запись файлов идут параллельно, прогон моделей — по одному
+engine_lock = threading.Lock()
+motion_gate = MotionGate.from_env()  # статичные кадры видео не гоняются через модели
 
 executor = ThreadPoolExecutor(max_workers=4)  # МНОГОПОТОЧНОСТЬ
 
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", 2))  # сколько файлов обрабатывается одновременно
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-# ПРОЦЕССИНГ МОДЕЛЯМИ
-def process_frame(frame):
-    results1 = model_firesmoke(frame)
-    frame1 = results1[0].plot()
+JOB_HISTORY = 1000  # сколько завершённых задач хранить для /jobs
 
-    results2 = model_gun(frame1)
-    frame2 = results2[0].plot()
+jobs = {}
+background_tasks = set()
+job_semaphore = asyncio.Semaphore(JOB_CONCURRENCY)
 
-    results3 = model_total(frame2)
-    final_frame = results3[0].plot()
 
-    return final_frame
+# ПРОЦЕССИНГ МОДЕЛЯМИ: все три модели на чистом кадре, рамки рисуются один раз
+def process_frames(frames, stream_id=None):
+    if stream_id is None:
+        with engine_lock:
+            return engine.process(frames)
+    # Кадры без заметных изменений получают рамки последнего прогона модели
+    changed = [motion_gate.needs_inference(stream_id, frame) for frame in frames]
+    with engine_lock:
+        predictions = iter(engine.predict([frame for frame, is_changed in zip(frames, changed) if is_changed]))
+    processed = []
+    for frame, is_changed in zip(frames, changed):
+        if is_changed:
+            motion_gate.update(stream_id, next(predictions))
+        processed.append(engine.annotate(frame, motion_gate.result(stream_id)))
+    return processed
+
+
+def process_frame(frame):
+    return process_frames([frame])[0]
 
 
 # ВИДОСЫ
-def process_video(video_path: str, output_path: str):
+def process_video(video_path: str, output_path: str, progress=None):
+    # Возвращает сколько кадров всего и сколько из них прошло через модели
+    # Без числа кадров в контейнере куски не нарезать — такие файлы читаются последовательно до конца
+    if VIDEO_MODE == "parallel" and video_info(video_path)[0] > 0:
+        frames, _, inferred = process_video_parallel(video_path, output_path, workers=VIDEO_WORKERS,
+                                                     stride=VIDEO_STRIDE, batch_size=BATCH_SIZE, progress=progress)
+        os.remove(video_path)
+        return {"frames": frames, "inferred": inferred}
+    return process_video_serial(video_path, output_path, progress)
+
+
+def process_video_serial(video_path: str, output_path: str, progress=None):
     cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 1
+    done_frames = 0
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")
     out = cv2.VideoWriter(output_path, fourcc, cap.get(cv2.CAP_PROP_FPS),
                           (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))))
 
+    def write(frames):
+        for processed_frame in frames:
+            with timed(MEDIA_STAGE_SECONDS.labels("encode")):
+                out.write(processed_frame)
+
+    batch = []
     while cap.isOpened():
-        ret, frame = cap.read()
+        with timed(MEDIA_STAGE_SECONDS.labels("decode")):
+            ret, frame = cap.read()
         if not ret:
             break
-        processed_frame = process_frame(frame)
-        out.write(processed_frame)
+        batch.append(frame)
+        if len(batch) == BATCH_SIZE:  # N кадров за один прогон модели
+            write(process_frames(batch, video_path))
+            done_frames += len(batch)
+            batch = []
+            if progress:
+                progress(min(done_frames / total_frames, 0.99))
+    if batch:
+        write(process_frames(batch, video_path))
 
     cap.release()
     out.release()
     os.remove(video_path)
+    motion = motion_gate.forget(video_path)
+    return {"frames": motion["frames"], "inferred": motion["frames"] - motion["skipped"]} if motion else None
 
 
-# ФОТКИ
-async def process_image(image_path: str, output_path: str):
-    frame = cv2.imread(image_path)
+# ФОТКИ (синхронно, вызывается в пуле потоков)
+def process_image(image_path: str, output_path: str, progress=None):
+    with timed(MEDIA_STAGE_SECONDS.labels("decode")):
+        frame = cv2.imread(image_path)
     processed_frame = process_frame(frame)
-    cv2.imwrite(output_path, processed_frame)
+    with timed(MEDIA_STAGE_SECONDS.labels("encode")):
+        cv2.imwrite(output_path, processed_frame)
     os.remove(image_path)
 
 
-# ЗАПРОС
+async def save_upload(file: UploadFile) -> str:
+    # Загрузка пишется на диск кусками, запись в файл уходит в пул потоков
+    loop = asyncio.get_running_loop()
+    temp = NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[-1])
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await loop.run_in_executor(executor, temp.write, chunk)
+    finally:
+        temp.close()
+    return temp.name
+
+
+async def process_job_file(entry: dict, temp_path: str, kind: str):
+    loop = asyncio.get_running_loop()
+    output_path = os.path.join("processed_media", f"processed_{entry['filename']}")
+    # Пишем во временное имя и переименовываем: файл в processed_media появляется только целиком
+    partial_path = os.path.join("processed_media", f".partial_{uuid.uuid4().hex}_{entry['filename']}")
+
+    def progress(value):
+        entry["progress"] = round(value, 3)
+
+    async with job_semaphore:
+        entry["status"] = "processing"
+        try:
+            handler = process_video if kind == "video" else process_image
+            summary = await loop.run_in_executor(executor, handler, temp_path, partial_path, progress)
+            if summary:
+                entry["frames"] = summary["frames"]
+                entry["skip_ratio"] = round(1 - summary["inferred"] / summary["frames"], 3) if summary["frames"] else 0.0
+            os.replace(partial_path, output_path)
+            entry["status"] = "done"
+            entry["progress"] = 1.0
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+            for path in (partial_path, temp_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+async def run_job(job_id: str, items: list):
+    job = jobs[job_id]
+    job["status"] = "processing"
+    await asyncio.gather(*(process_job_file(entry, temp_path, kind) for entry, temp_path, kind in items))
+    job["status"] = "failed" if any(entry["status"] == "failed" for entry in job["files"]) else "done"
+
+
+# ЗАПРОС: сразу возвращает id задачи, обработка идёт в фоне
 @app.post("/predict/media/")
 async def predict_media(files: List[UploadFile] = File(...)):
     os.makedirs("processed_media", exist_ok=True)
-    loop = asyncio.get_event_loop()
-
-    video_tasks = []
-    image_tasks = []
-    media_urls = []
+    job_id = uuid.uuid4().hex
+    job = {"job_id": job_id, "status": "queued", "files": []}
+    items = []
 
     for file in files:
-        temp = NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[-1])
-        shutil.copyfileobj(file.file, temp)
-        temp.close()
-
-        output_path = os.path.join("processed_media", f"processed_{file.filename}")
-
         if file.content_type.startswith("video"):  # ПОТОК
-            task = loop.run_in_executor(executor, process_video, temp.name, output_path)
-            video_tasks.append(task)
-
+            kind = "video"
         elif file.content_type.startswith("image"):
-            task = process_image(temp.name, output_path)
-            image_tasks.append(task)
+            kind = "image"
+        else:
+            continue
 
-        media_urls.append({
+        entry = {
             "filename": file.filename,
-            "url": f"http://localhost:8000/media/processed_{file.filename}"
-        })
-
-    await asyncio.gather(*image_tasks)
-    await asyncio.gather(*video_tasks)
-
-    return media_urls
+            "url": f"http://localhost:8000/media/processed_{file.filename}",
+            "status": "queued",
+            "progress": 0.0
+        }
+        job["files"].append(entry)
+        items.append((entry, await save_upload(file), kind))
+
+    finished = [key for key, value in jobs.items() if value["status"] in ("done", "failed")]
+    for key in finished[:max(0, len(finished) - JOB_HISTORY)]:
+        del jobs[key]
+    jobs[job_id] = job
+    task = asyncio.create_task(run_job(job_id, items))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    return {
+        "job_id": job_id,
+        "status_url": f"/predict/media/jobs/{job_id}",
+        "files": job["files"]
+    }
+
+
+@app.get("/predict/media/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+
+# МОДЕЛИ: грузятся при первом запросе; прогрев можно сделать заранее
+@app.get("/models")
+async def models_stats():
+    return engine.models.metrics()
+
+
+def locked_warmup():
+    with engine_lock:
+        return engine.models.warmup()
+
+
+@app.post("/models/warmup")
+async def models_warmup():
+    # Под тем же замком, что и инференс: загрузка не должна идти параллельно с задачей на тех же моделях
+    loaded = await asyncio.get_running_loop().run_in_executor(executor, locked_warmup)
+    return {"warmup_seconds": loaded, **engine.models.metrics()}
+
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = render()
+    if body is None:
+        return Response("prometheus_client не установлен", status_code=503, media_type=content_type)
+    return Response(body, media_type=content_type)
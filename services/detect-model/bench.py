@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# Офлайн-замер пропускной способности детекции. Сценарии:
+#   frame — app.process_frame на одном кадре
+#   video — app.process_video на синтетическом или записанном ролике
+#   detect — POST /detect приложения plot_results (в процессе, через httpx ASGITransport)
+#   media — POST /predict/media/ приложения app и ожидание задачи до done
+# Каждый сценарий запускается отдельным процессом: модели и пиковый RSS не смешиваются.
+# Результат — JSON, который можно сравнивать между запусками.
+
+SCENARIOS = ("frame", "video", "detect", "media")
+
+# Один event loop на процесс: планировщик и семафоры приложений привязываются к нему при первом запросе
+loop = asyncio.new_event_loop()
+
+
+def percentiles(values):
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000
+
+    return {
+        "p50": round(pick(0.50), 2),
+        "p95": round(pick(0.95), 2),
+        "p99": round(pick(0.99), 2),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 2)
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def make_frames(resolution, count, frames_dir=None, seed=0):
+    # Записанные кадры приводятся к нужному разрешению; иначе — шум с движущимся прямоугольником
+    width, height = resolution
+    if frames_dir:
+        paths = sorted(path for pattern in ("*.jpg", "*.jpeg", "*.png") for path in glob.glob(os.path.join(frames_dir, pattern)))
+        frames = [cv2.resize(frame, (width, height)) for frame in (cv2.imread(path) for path in paths) if frame is not None]
+        if frames:
+            return [frames[i % len(frames)] for i in range(count)]
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(count):
+        frame = base.copy()
+        x = (i * 17) % max(1, width - 100)
+        cv2.rectangle(frame, (x, height // 3), (x + 100, height // 3 + 80), (0, 0, 255), -1)
+        frames.append(frame)
+    return frames
+
+
+def write_video(path, frames, fps=25):
+    height, width = frames[0].shape[:2]
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for frame in frames:
+        out.write(frame)
+    out.release()
+
+
+def encode_jpeg(frame):
+    return cv2.imencode(".jpg", frame)[1].tobytes()
+
+
+def bench_frame(args, resolution, concurrency):
+    import app
+
+    frames = make_frames(resolution, args.requests, args.frames_dir)
+    app.process_frame(frames[0])  # прогрев
+    latencies = []
+    started = time.perf_counter()
+    for frame in frames:
+        begin = time.perf_counter()
+        app.process_frame(frame)
+        latencies.append(time.perf_counter() - begin)
+    return latencies, time.perf_counter() - started, len(frames)
+
+
+def bench_video(args, resolution, concurrency):
+    import app
+
+    work_dir = tempfile.mkdtemp(prefix="bench_video_")
+    try:
+        source = args.video
+        if not source:
+            source = os.path.join(work_dir, "source.mp4")
+            write_video(source, make_frames(resolution, args.video_frames, args.frames_dir))
+        frame_count = int(cv2.VideoCapture(source).get(cv2.CAP_PROP_FRAME_COUNT))
+        app.process_frame(make_frames(resolution, 1)[0])  # прогрев
+        latencies = []
+        started = time.perf_counter()
+        for run in range(args.video_runs):
+            # process_video удаляет входной файл, поэтому каждому прогону своя копия
+            copy = os.path.join(work_dir, f"input_{run}.mp4")
+            shutil.copy(source, copy)
+            begin = time.perf_counter()
+            app.process_video(copy, os.path.join(work_dir, f"output_{run}.mp4"))
+            latencies.append(time.perf_counter() - begin)
+        return latencies, time.perf_counter() - started, frame_count * args.video_runs
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def run_clients(concurrency, requests, send):
+    # concurrency клиентов шлют запросы по очереди, пока не наберётся requests
+    latencies = []
+    counter = iter(range(requests))
+
+    async def client(client_index):
+        for index in counter:
+            begin = time.perf_counter()
+            await send(client_index, index)
+            latencies.append(time.perf_counter() - begin)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+def bench_detect(args, resolution, concurrency):
+    import httpx
+    import plot_results
+
+    frames = [encode_jpeg(frame) for frame in make_frames(resolution, min(args.requests, 32), args.frames_dir)]
+    bodies = [{"image": "data:image/jpeg;base64," + base64.b64encode(jpeg).decode()} for jpeg in frames]
+
+    async def main():
+        transport = httpx.ASGITransport(app=plot_results.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            # Свой client_id на клиента, иначе планировщик отбрасывает кадры как устаревшие
+            async def send(client_index, index):
+                response = await client.post("/detect", json={**bodies[index % len(bodies)],
+                                                               "client_id": f"bench-{client_index}"})
+                response.raise_for_status()
+
+            await send(0, 0)  # прогрев
+            return await run_clients(concurrency, args.requests, send)
+
+    latencies, elapsed = loop.run_until_complete(main())
+    return latencies, elapsed, args.requests
+
+
+def bench_media(args, resolution, concurrency):
+    import httpx
+    import app
+
+    jpeg = encode_jpeg(make_frames(resolution, 1, args.frames_dir)[0])
+
+    async def main():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            async def send(client_index, index):
+                response = await client.post("/predict/media/",
+                                             files={"files": (f"bench_{client_index}_{index}.jpg", jpeg, "image/jpeg")})
+                response.raise_for_status()
+                status_url = response.json()["status_url"]
+                while True:
+                    job = (await client.get(status_url)).json()
+                    if job["status"] in ("done", "failed"):
+                        if job["status"] == "failed":
+                            raise RuntimeError(f"задача не выполнена: {job}")
+                        return
+                    await asyncio.sleep(0.01)
+
+            await send(0, -1)  # прогрев
+            return await run_clients(concurrency, args.requests, send)
+
+    try:
+        latencies, elapsed = loop.run_until_complete(main())
+    finally:
+        for path in glob.glob(os.path.join("processed_media", "processed_bench_*.jpg")):
+            os.remove(path)
+    return latencies, elapsed, args.requests
+
+
+def run_scenario(args):
+    os.makedirs("processed_media", exist_ok=True)
+    bench = {"frame": bench_frame, "video": bench_video, "detect": bench_detect, "media": bench_media}[args.scenario]
+    results = []
+    for resolution in [parse_resolution(r) for r in args.resolutions.split(",")]:
+        # Кадр и видео обрабатываются в одном потоке: модели не потокобезопасны
+        levels = [1] if args.scenario in ("frame", "video") else [int(c) for c in args.concurrency.split(",")]
+        for concurrency in levels:
+            latencies, elapsed, items = bench(args, resolution, concurrency)
+            results.append({
+                "scenario": args.scenario,
+                "resolution": f"{resolution[0]}x{resolution[1]}",
+                "concurrency": concurrency,
+                "requests": len(latencies),
+                "latency_ms": percentiles(latencies),
+                "throughput_per_s": round(len(latencies) / elapsed, 3),
+                "frames_per_s": round(items / elapsed, 3),
+                "peak_rss_mb": peak_rss_mb()
+            })
+            print(f"{args.scenario:<7} {resolution[0]}x{resolution[1]:<5} c={concurrency:<3} "
+                  f"p50 {results[-1]['latency_ms']['p50']:8.1f} мс  p95 {results[-1]['latency_ms']['p95']:8.1f} мс  "
+                  f"{results[-1]['frames_per_s']:7.2f} кадр/с  RSS {results[-1]['peak_rss_mb']} МБ", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк сервисов детекции, результат в JSON")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="можно указать несколько раз; по умолчанию все")
+    parser.add_argument("--resolutions", default="640x480,1280x720,1920x1080")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--frames-dir", help="записанные кадры вместо синтетических")
+    parser.add_argument("--video", help="записанный ролик для сценария video")
+    parser.add_argument("--video-frames", type=int, default=150)
+    parser.add_argument("--video-runs", type=int, default=3)
+    parser.add_argument("--motion-gate", action="store_true", help="не отключать MotionGate")
+    parser.add_argument("--output", default="-", help="файл для JSON, - — stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with open(args.output, "w") as f:
+            json.dump(run_scenario(argparse.Namespace(**{**vars(args), "scenario": args.scenario[0]})), f)
+        return
+
+    # Одинаковые условия между запусками: фильтр статичных кадров выключен, если не просили иное
+    env = dict(os.environ)
+    if not args.motion_gate:
+        env["MOTION_GATE"] = "0"
+    results = []
+    for scenario in args.scenario or SCENARIOS:
+        # Модели и приложения печатают в stdout, поэтому дочерний процесс пишет результат в файл
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as child_output:
+            pass
+        command = [sys.executable, os.path.abspath(__file__), "--child", "--scenario", scenario,
+                   "--resolutions", args.resolutions, "--concurrency", args.concurrency,
+                   "--requests", str(args.requests), "--video-frames", str(args.video_frames),
+                   "--video-runs", str(args.video_runs), "--output", child_output.name]
+        if args.frames_dir:
+            command += ["--frames-dir", args.frames_dir]
+        if args.video:
+            command += ["--video", args.video]
+        try:
+            completed = subprocess.run(command, env=env, stdout=sys.stderr)
+            if completed.returncode != 0:
+                results.append({"scenario": scenario, "error": f"код выхода {completed.returncode}"})
+                continue
+            with open(child_output.name) as f:
+                results.extend(json.load(f))
+        finally:
+            os.remove(child_output.name)
+
+    report = {
+        "suite": "detect-model",
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "env": {key: env.get(key) for key in ("MODEL_RUNTIME", "MODEL_INT8", "MODEL_THREADS", "INFERENCE_BATCH_SIZE",
+                                              "VIDEO_MODE", "VIDEO_WORKERS", "VIDEO_STRIDE", "TILE_MODE", "MOTION_GATE")},
+        "args": {key: value for key, value in vars(args).items() if key not in ("child", "output")},
+        "results": results
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
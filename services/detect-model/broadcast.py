@@ -0,0 +1,99 @@
+import asyncio
+import json
+import logging
+import time
+
+from fastapi import WebSocket
+
+from metrics import STAGE_SECONDS, VIEWERS
+
+# Рассылка тревог зрителям /ws. Сообщение сериализуется один раз, у каждого клиента своя
+# ограниченная очередь и своя задача отправки: медленный клиент теряет старые сообщения,
+# а не тормозит остальных. Мёртвые сокеты отключаются сами.
+
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, max_queue: int):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.task = None
+        self.sent = 0
+        self.dropped = 0
+        self.send_time_total = 0.0
+        self.last_latency = 0.0
+
+    def offer(self, text: str):
+        # Очередь полна — выкидываем самое старое сообщение, новое важнее
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait((text, time.perf_counter()))
+
+    def metrics(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "avg_latency": self.send_time_total / self.sent if self.sent else 0.0,
+            "last_latency": self.last_latency
+        }
+
+
+class ConnectionManager:
+    def __init__(self, max_queue: int = 8, send_timeout: float = 5.0):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.clients = {}
+
+    @property
+    def active_connections(self):
+        return list(self.clients)
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        client = ClientConnection(websocket, self.max_queue)
+        client.task = asyncio.create_task(self._sender(client))
+        self.clients[websocket] = client
+        VIEWERS.set(len(self.clients))
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        VIEWERS.set(len(self.clients))
+        if client is not None and client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    async def _sender(self, client: ClientConnection):
+        while True:
+            text, enqueued_at = await client.queue.get()
+            try:
+                await asyncio.wait_for(client.websocket.send_text(text), self.send_timeout)
+            except Exception as e:
+                logging.info(f"Зритель отключён при отправке: {e!r}")
+                self.disconnect(client.websocket)
+                try:
+                    await client.websocket.close()
+                except Exception:
+                    pass
+                return
+            latency = time.perf_counter() - enqueued_at
+            client.sent += 1
+            client.send_time_total += latency
+            client.last_latency = latency
+            STAGE_SECONDS.labels("broadcast").observe(latency)
+
+    async def broadcast(self, message: dict):
+        text = json.dumps(message, ensure_ascii=False)
+        for client in list(self.clients.values()):
+            client.offer(text)
+
+    def metrics(self):
+        return {
+            "clients": len(self.clients),
+            "per_client": [
+                {"client": f"{ws.client.host}:{ws.client.port}" if ws.client else str(id(ws)), **client.metrics()}
+                for ws, client in self.clients.items()
+            ]
+        }
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import cv2
+
+from metrics import CAMERA_FRAMES, CAMERA_LAG
+
+# Приём кадров с камер (RTSP) и видеофайлов (как замена камер на стенде).
+# Каждый источник декодируется в своём потоке, в буфере лежит только последний кадр:
+# если инференс не успевает, старые кадры перезаписываются и считаются потерянными.
+# На каждый поток — асинхронная задача, которая с заданной частотой отправляет свежий кадр
+# в общий планировщик пачек; у планировщика не больше одного кадра на поток, поэтому
+# пачки делятся между камерами поровну.
+
+
+def valid_fps(fps):
+    return (isinstance(fps, (int, float)) and not isinstance(fps, bool)
+            and math.isfinite(fps) and fps > 0)
+
+
+class CameraSource(threading.Thread):
+    def __init__(self, name, url, reconnect_delay=2.0, max_reconnect_delay=30.0):
+        super().__init__(daemon=True, name=f"camera-{name}")
+        self.camera = name
+        self.url = url
+        self.is_file = os.path.exists(url)
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.frame = None
+        self.captured_at = 0.0
+        self.sequence = 0
+        self.decoded = 0
+        self.overwritten = 0
+        self.taken_sequence = 0
+        self.connected = False
+        self.error = None
+
+    def run(self):
+        delay = self.reconnect_delay
+        while not self.stopped.is_set():
+            cap = cv2.VideoCapture(self.url, cv2.CAP_FFMPEG)
+            if not cap.isOpened():
+                self.connected = False
+                self.error = "не удалось открыть источник"
+                logging.info(f"{self.name}: {self.error}, повтор через {delay:.0f} с")
+                self.stopped.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            self.connected, self.error = True, None
+            # Файл читается в реальном темпе и по кругу, как живая камера
+            frame_interval = 1 / (cap.get(cv2.CAP_PROP_FPS) or 25.0) if self.is_file else 0.0
+            next_frame = time.monotonic()
+            # Кадры с момента открытия или перемотки: файл без читаемых кадров иначе перематывался бы вхолостую
+            frames_read = 0
+            while not self.stopped.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    if self.is_file and frames_read:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        frames_read = 0
+                        continue
+                    self.error = "поток прервался" if frames_read or not self.is_file else "в файле нет читаемых кадров"
+                    break
+                frames_read += 1
+                delay = self.reconnect_delay
+                self.publish(frame)
+                if frame_interval:
+                    next_frame += frame_interval
+                    self.stopped.wait(max(0.0, next_frame - time.monotonic()))
+            cap.release()
+            self.connected = False
+            # Обрыв сразу после открытия — тоже с паузой, а не переподключение в цикле
+            if self.error and not self.stopped.is_set():
+                logging.info(f"{self.name}: {self.error}, повтор через {delay:.0f} с")
+                self.stopped.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def publish(self, frame):
+        with self.lock:
+            if self.sequence > self.taken_sequence:
+                self.overwritten += 1
+                CAMERA_FRAMES.labels(self.camera, "dropped").inc()
+            self.frame = frame
+            self.captured_at = time.time()
+            self.sequence += 1
+            self.decoded += 1
+
+    def latest(self):
+        # Новый кадр с момента прошлого вызова или None
+        with self.lock:
+            if self.sequence == self.taken_sequence:
+                return None, 0.0
+            self.taken_sequence = self.sequence
+            return self.frame, self.captured_at
+
+    def stop(self):
+        self.stopped.set()
+
+
+class CameraStream:
+    def __init__(self, name, url, fps):
+        self.name = name
+        self.url = url
+        self.fps = fps
+        self.source = CameraSource(name, url)
+        self.task = None
+        self.analyzed = 0
+        self.failed = 0
+        self.last_lag = 0.0
+        self.lag_total = 0.0
+        self.window_started = time.monotonic()
+        self.window_frames = 0
+        self.inference_fps = 0.0
+
+    def record(self, captured_at):
+        lag = time.time() - captured_at
+        CAMERA_LAG.labels(self.name).set(lag)
+        CAMERA_FRAMES.labels(self.name, "analyzed").inc()
+        self.analyzed += 1
+        self.last_lag = lag
+        self.lag_total += lag
+        self.window_frames += 1
+        elapsed = time.monotonic() - self.window_started
+        if elapsed >= 5:
+            self.inference_fps = self.window_frames / elapsed
+            self.window_started, self.window_frames = time.monotonic(), 0
+
+    def metrics(self):
+        source = self.source
+        return {
+            "url": self.url,
+            "target_fps": self.fps,
+            "connected": source.connected,
+            "error": source.error,
+            "decoded": source.decoded,
+            "dropped": source.overwritten,
+            "analyzed": self.analyzed,
+            "failed": self.failed,
+            "inference_fps": round(self.inference_fps, 2),
+            "lag": round(self.last_lag, 3),
+            "avg_lag": round(self.lag_total / self.analyzed, 3) if self.analyzed else 0.0
+        }
+
+
+class CameraManager:
+    def __init__(self, analyze, default_fps=5.0, forget=None):
+        # analyze(frame, stream_id) — корутина разбора кадра (в plot_results это analyze_frame),
+        # forget(stream_id) — сброс состояния потока (трекер, детектор движения) при удалении камеры
+        self.analyze = analyze
+        self.forget = forget
+        self.default_fps = default_fps
+        self.streams = {}
+
+    def add(self, name, url, fps=None):
+        if name in self.streams:
+            raise ValueError(f"Камера {name} уже зарегистрирована")
+        # Частота задаёт интервал опроса 1 / fps: ноль или отрицательное значение уронили бы задачу камеры
+        if fps is not None and not valid_fps(fps):
+            raise ValueError(f"Камера {name}: некорректный fps {fps!r}")
+        stream = CameraStream(name, url, fps or self.default_fps)
+        stream.source.start()
+        stream.task = asyncio.create_task(self._run(stream))
+        self.streams[name] = stream
+        logging.info(f"Камера {name} подключена: {url}, {stream.fps} кадр/с")
+        return stream
+
+    async def remove(self, name):
+        stream = self.streams.pop(name, None)
+        if stream is None:
+            return False
+        stream.source.stop()
+        stream.task.cancel()
+        try:
+            await stream.task
+        except asyncio.CancelledError:
+            pass
+        if self.forget is not None:
+            self.forget(self.stream_id(name))
+        return True
+
+    def load(self, path):
+        # Файл со списком камер: [{"name": ..., "url": ..., "fps": ...}]
+        with open(path, encoding="utf-8") as f:
+            for camera in json.load(f):
+                try:
+                    self.add(camera["name"], camera["url"], camera.get("fps"))
+                except ValueError as e:
+                    logging.info(f"{path}: {e}, камера пропущена")
+
+    @staticmethod
+    def stream_id(name):
+        return f"camera-{name}"
+
+    async def _run(self, stream):
+        stream_id = self.stream_id(stream.name)
+        interval = 1 / stream.fps
+        next_tick = time.monotonic()
+        while True:
+            next_tick = max(next_tick + interval, time.monotonic())
+            frame, captured_at = stream.source.latest()
+            if frame is not None:
+                try:
+                    await self.analyze(frame, stream_id)
+                    stream.record(captured_at)
+                except Exception as e:
+                    stream.failed += 1
+                    CAMERA_FRAMES.labels(stream.name, "failed").inc()
+                    logging.info(f"Камера {stream.name}: ошибка разбора кадра: {e!r}")
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+
+    async def close(self):
+        for name in list(self.streams):
+            await self.remove(name)
+
+    def metrics(self):
+        return {name: stream.metrics() for name, stream in self.streams.items()}
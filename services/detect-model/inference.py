@@ -0,0 +1,115 @@
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+from ultralytics.utils.plotting import Annotator, colors
+
+from registry import ModelRegistry
+from tiling import TiledPredictor
+from metrics import INFERENCE_BATCH, INFERENCE_SECONDS, timed
+
+# Общий движок инференса: все модели работают на чистом кадре, кадры идут пачками,
+# рамки рисуются один раз в конце.
+
+MODEL_FILES = {
+    "firesmoke": "firesmoke.pt",
+    "gunonly": "gunonly.pt",
+    "total": "total.pt"
+}
+
+
+class InferenceEngine:
+    def __init__(self, models, batch_size=8, tiler=None):
+        # models: имя -> YOLO (словарь или ModelRegistry); tiler — плиточный режим для мелких объектов
+        self.models = models
+        self.batch_size = batch_size
+        self.tiler = tiler
+
+    @classmethod
+    def from_files(cls, files=None, batch_size=8, config=None):
+        # Рантайм (torch/onnx/openvino, INT8, потоки) выбирается в runtime.py по переменным окружения.
+        # Модели грузятся лениво; MODEL_PRELOAD=1 загружает их сразу (для gunicorn --preload, чтобы
+        # форкнутые воркеры делили страницы весов с мастером)
+        registry = ModelRegistry(files or MODEL_FILES, config)
+        if os.environ.get("MODEL_PRELOAD", "0") == "1":
+            registry.warmup()
+            registry.freeze()
+        return cls(registry, batch_size=batch_size, tiler=TiledPredictor.from_env())
+
+    def predict(self, frames, names=None):
+        # Возвращает по кадру словарь имя модели -> Results
+        names = names or list(self.models)
+        outputs = [{} for _ in frames]
+        for start in range(0, len(frames), self.batch_size):
+            chunk = frames[start:start + self.batch_size]
+            for name in names:
+                model = self.models[name]
+                INFERENCE_BATCH.labels(name).observe(len(chunk))
+                with timed(INFERENCE_SECONDS.labels(name)):
+                    if self.tiler is not None and self.tiler.applies_to(name):
+                        # Плитки одного кадра уходят в модель своей пачкой
+                        results = [self.tiler.predict(model, frame) for frame in chunk]
+                    else:
+                        results = model(chunk, verbose=False)
+                for offset, result in enumerate(results):
+                    outputs[start + offset][name] = result
+        return outputs
+
+    def annotate(self, frame, results_by_model):
+        annotator = Annotator(frame.copy())
+        for name, result in results_by_model.items():
+            # Сдвиг палитры, чтобы классы разных моделей не совпадали по цвету
+            palette_offset = list(self.models).index(name) * 7
+            boxes = result.boxes
+            if boxes is None or len(boxes) == 0:
+                continue
+            xyxy = boxes.xyxy.cpu().numpy()
+            cls = boxes.cls.cpu().numpy().astype(int)
+            conf = boxes.conf.cpu().numpy()
+            for box, class_id, score in zip(xyxy, cls, conf):
+                label = f"{result.names[class_id]} {score:.2f}"
+                annotator.box_label(box, label, color=colors(class_id + palette_offset, True))
+        return annotator.result()
+
+    def process(self, frames, names=None):
+        return [self.annotate(frame, results) for frame, results in zip(frames, self.predict(frames, names))]
+
+
+def thread_local_engines(factory):
+    # YOLO-предиктор не потокобезопасен: каждому потоку пула свой экземпляр моделей
+    local = threading.local()
+
+    def get():
+        if not hasattr(local, "engine"):
+            local.engine = factory()
+        return local.engine
+    return get
+
+
+def benchmark(engine, batch_sizes, frames_total, width, height):
+    # Пропускная способность в зависимости от размера пачки, на синтетических кадрах
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(frames_total)]
+    engine.predict(frames[:1])  # прогрев
+    report = []
+    for batch_size in batch_sizes:
+        engine.batch_size = batch_size
+        started = time.perf_counter()
+        engine.predict(frames)
+        elapsed = time.perf_counter() - started
+        report.append((batch_size, frames_total / elapsed))
+        print(f"batch={batch_size:>3}  {frames_total / elapsed:7.2f} кадр/с  ({elapsed:.2f} с на {frames_total} кадров)")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер пропускной способности InferenceEngine на CPU")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16")
+    parser.add_argument("--frames", type=int, default=64)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    args = parser.parse_args()
+    benchmark(InferenceEngine.from_files(), [int(b) for b in args.batch_sizes.split(",")],
+              args.frames, args.width, args.height)
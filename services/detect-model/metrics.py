@@ -0,0 +1,77 @@
+import time
+from contextlib import contextmanager
+
+# Метрики Prometheus для /metrics обоих приложений. prometheus_client необязателен:
+# без него метрики ничего не делают, а /metrics отвечает 503.
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, value=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _histogram(name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Histogram(name, documentation, labels, buckets=buckets)
+
+
+def _counter(name, documentation, labels=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, documentation, labels)
+
+
+def _gauge(name, documentation, labels=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Gauge(name, documentation, labels)
+
+
+# decode — разбор входного кадра, scheduler — ожидание пачки в планировщике вместе с инференсом,
+# postprocess — разбор рамок, encode — JPEG и ответ клиенту, broadcast — от постановки тревоги
+# в очередь зрителя до отправки
+STAGE_SECONDS = _histogram("detect_stage_seconds", "Длительность этапов обработки кадра", ["stage"])
+# Задачи app.py: decode — чтение кадра из файла, encode — запись обработанного кадра, на кадр
+MEDIA_STAGE_SECONDS = _histogram("media_stage_seconds", "Чтение и запись кадров загруженных файлов", ["stage"])
+INFERENCE_SECONDS = _histogram("detect_inference_seconds", "Прогон пачки кадров через модель", ["model"])
+INFERENCE_BATCH = _histogram("detect_inference_batch_size", "Размер пачки кадров", ["model"],
+                             buckets=(1, 2, 4, 8, 16, 32, 64))
+FRAMES = _counter("detect_frames_total", "Кадры по итогу обработки", ["result"])
+ALERTS = _counter("detect_alerts_total", "Разосланные тревоги", ["label"])
+VIEWERS = _gauge("detect_viewers", "Подключённые зрители /ws")
+CAMERA_LAG = _gauge("detect_camera_lag_seconds", "Задержка от захвата кадра камеры до результата", ["camera"])
+CAMERA_FRAMES = _counter("detect_camera_frames_total", "Кадры камер", ["camera", "result"])
+
+
+@contextmanager
+def timed(histogram):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started)
+
+
+def render():
+    # Тело и Content-Type для /metrics
+    if prometheus_client is None:
+        return None, "text/plain"
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
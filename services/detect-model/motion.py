@@ -0,0 +1,112 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+# Дешёвый фильтр перед инференсом: кадр уменьшается до миниатюры в оттенках серого
+# и сравнивается с миниатюрой последнего кадра, прошедшего через модель.
+# Если среднее изменение ниже порога — модель не запускается, используется прошлый результат.
+# Раз в force_every кадров инференс выполняется в любом случае.
+
+
+class StreamState:
+    def __init__(self):
+        self.reference = None
+        self.result = None
+        self.since_inference = 0
+        self.frames = 0
+        self.skipped = 0
+        self.last_seen = time.monotonic()
+
+    def metrics(self):
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "skip_ratio": self.skipped / self.frames if self.frames else 0.0
+        }
+
+
+class MotionGate:
+    def __init__(self, threshold=3.0, force_every=30, size=(64, 36), enabled=True, idle_timeout=300.0):
+        # threshold — средняя разница яркости миниатюр (0..255), ниже которой кадр считается статичным
+        self.threshold = threshold
+        self.force_every = force_every
+        self.size = size
+        self.enabled = enabled
+        self.idle_timeout = idle_timeout
+        self.streams = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            threshold=float(os.environ.get("MOTION_THRESHOLD", 3.0)),
+            force_every=int(os.environ.get("MOTION_FORCE_EVERY", 30)),
+            enabled=os.environ.get("MOTION_GATE", "1") != "0"
+        )
+
+    def thumbnail(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        # Размытие гасит шум матрицы и артефакты сжатия
+        return cv2.GaussianBlur(gray, (3, 3), 0).astype(np.int16)
+
+    def _state(self, stream_id):
+        state = self.streams.get(stream_id)
+        if state is None:
+            self.prune()
+            state = self.streams[stream_id] = StreamState()
+        state.last_seen = time.monotonic()
+        return state
+
+    def needs_inference(self, stream_id, frame):
+        # True — кадр нужно прогнать через модель и затем передать результат в update()
+        state = self._state(stream_id)
+        state.frames += 1
+        if not self.enabled:
+            return True
+        thumb = self.thumbnail(frame)
+        if (state.reference is not None and state.result is not None
+                and state.since_inference + 1 < self.force_every
+                and float(np.abs(thumb - state.reference).mean()) < self.threshold):
+            state.since_inference += 1
+            state.skipped += 1
+            return False
+        state.reference = thumb
+        state.since_inference = 0
+        return True
+
+    def update(self, stream_id, result):
+        self._state(stream_id).result = result
+
+    def result(self, stream_id):
+        state = self.streams.get(stream_id)
+        return state.result if state is not None else None
+
+    def reset(self, stream_id):
+        # Результат для опорного кадра потерян (кадр отброшен) — следующий кадр пойдёт в модель
+        state = self.streams.get(stream_id)
+        if state is not None:
+            state.reference = None
+            state.result = None
+
+    def forget(self, stream_id):
+        state = self.streams.pop(stream_id, None)
+        return state.metrics() if state is not None else None
+
+    def prune(self):
+        now = time.monotonic()
+        for stream_id in [key for key, state in self.streams.items() if now - state.last_seen > self.idle_timeout]:
+            self.streams.pop(stream_id, None)
+
+    def metrics(self):
+        streams = list(self.streams.items())
+        frames = sum(state.frames for _, state in streams)
+        skipped = sum(state.skipped for _, state in streams)
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "force_every": self.force_every,
+            "skip_ratio": skipped / frames if frames else 0.0,
+            "streams": {str(stream_id): state.metrics() for stream_id, state in streams}
+        }
@@ -1,19 +1,54 @@
+import asyncio
+import os
 import cv2
 import torch
 import numpy as np
 import base64
+import json
 import time
+import uuid
 from io import BytesIO
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from ultralytics import YOLO
+from inference import InferenceEngine, thread_local_engines
+from scheduler import BatchScheduler, FrameDropped
+from broadcast import ConnectionManager
+from tracking import IouTracker, TrackerRegistry
+from motion import MotionGate
+from postprocess import summarize_detections
+from cameras import CameraManager, valid_fps
+from metrics import ALERTS, FRAMES, STAGE_SECONDS, render, timed
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 app = FastAPI()
 
-model_firesmoke = YOLO("firesmoke.pt")
-model_gun = YOLO("gunonly.pt")
-model_total = YOLO("total.pt")
+# Модели грузятся лениво, при первом кадре или через POST /models/warmup
+engine = InferenceEngine.from_files()
+
+DETECT_MODELS = ["firesmoke", "gunonly"]
+DETECT_WORKERS = int(os.environ.get("DETECT_WORKERS", 1))
+
+if DETECT_WORKERS > 1:
+    worker_engine = thread_local_engines(InferenceEngine.from_files)
+else:
+    worker_engine = lambda: engine
+
+
+def infer_batch(frames):
+    return worker_engine().predict(frames, names=DETECT_MODELS)
+
+
+scheduler = BatchScheduler(
+    infer_batch,
+    max_batch=int(os.environ.get("DETECT_MAX_BATCH", 8)),
+    max_delay=float(os.environ.get("DETECT_MAX_DELAY_MS", 20)) / 1000,
+    workers=DETECT_WORKERS
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,22 +60,45 @@ app.add_middleware(
 
 
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections = []
+motion_gate = MotionGate.from_env()
+
+ALERT_LABELS = ("fire", "pistol")
+ALERT_CONFIDENCE = 0.80
+
+trackers = TrackerRegistry(lambda: IouTracker(
+    iou_threshold=float(os.environ.get("TRACK_IOU", 0.3)),
+    min_hits=int(os.environ.get("TRACK_MIN_HITS", 2)),
+    max_misses=int(os.environ.get("TRACK_MAX_MISSES", 15)),
+    escalation=float(os.environ.get("TRACK_ESCALATION", 0.05)),
+    realert_interval=float(os.environ.get("TRACK_REALERT_SECONDS", 60)),
+    immediate_confidence=0.83  # пистолет выше этого порога — тревога с первого кадра, как раньше
+))
+
+manager = ConnectionManager(
+    max_queue=int(os.environ.get("BROADCAST_QUEUE_SIZE", 8)),
+    send_timeout=float(os.environ.get("BROADCAST_SEND_TIMEOUT", 5))
+)
+
+# Декодер msgpack для страницы камеры: локальная копия (MSGPACK_JS_PATH) или CDN с зафиксированной версией.
+# Для CDN хеш SRI задаётся в MSGPACK_JS_INTEGRITY (sha384-...), чтобы подменённый файл не исполнился
+MSGPACK_JS_PATH = os.environ.get("MSGPACK_JS_PATH")
+MSGPACK_JS_URL = "https://unpkg.com/@msgpack/msgpack@2.8.0/dist.es5+umd/msgpack.min.js"
+MSGPACK_JS_INTEGRITY = os.environ.get("MSGPACK_JS_INTEGRITY")
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+def msgpack_script_tag():
+    if MSGPACK_JS_PATH:
+        return '<script src="/static/msgpack.min.js"></script>'
+    integrity = f' integrity="{MSGPACK_JS_INTEGRITY}"' if MSGPACK_JS_INTEGRITY else ""
+    return f'<script src="{MSGPACK_JS_URL}"{integrity} crossorigin="anonymous"></script>'
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_json(message)
 
-manager = ConnectionManager()
+@app.get("/static/msgpack.min.js")
+def get_msgpack_js():
+    if not MSGPACK_JS_PATH:
+        return JSONResponse(status_code=404, content={"error": "MSGPACK_JS_PATH не задан"})
+    return FileResponse(MSGPACK_JS_PATH, media_type="application/javascript")
+
 
 @app.get("/", response_class=HTMLResponse) # ИМИТАЦИЯ КАМЕРЫ
 def get_camera_page():
@@ -55,18 +113,41 @@ def get_camera_page():
         <video id="video" autoplay playsinline></video>
         <canvas id="canvas"></canvas>
         <img id="output" />
+        __MSGPACK_SCRIPT__
         <script>
-            const ws = new WebSocket("ws://" + location.host + "/ws");
-            ws.onmessage = (event) => {
-                const data = JSON.parse(event.data);
-                console.log("Log:", data.log);
-                document.getElementById("output").src = data.image;
-            };
+            // Кадры уходят сырыми JPEG-байтами по одному сокету, ответы — msgpack/JSON + отдельный JPEG.
+            // Если декодер msgpack с CDN не загрузился, просим у сервера JSON
+            const format = typeof MessagePack === "undefined" ? "json" : "msgpack";
+            const ws = new WebSocket("ws://" + location.host + "/ws/detect?format=" + format);
+            ws.binaryType = "arraybuffer";
+            const output = document.getElementById("output");
+            const decoder = new TextDecoder();
 
             const video = document.getElementById("video");
             const canvas = document.getElementById("canvas");
             const ctx = canvas.getContext("2d");
 
+            ws.onmessage = (event) => {
+                const bytes = new Uint8Array(event.data);
+                const body = bytes.subarray(1);
+                if (bytes[0] === 2) {
+                    URL.revokeObjectURL(output.src);
+                    output.src = URL.createObjectURL(new Blob([body], { type: "image/jpeg" }));
+                    return;
+                }
+                try {
+                    const result = bytes[0] === 1 ? MessagePack.decode(body) : JSON.parse(decoder.decode(body));
+                    if (result.stats && result.stats.log) {
+                        console.log("Log:", result.stats.log);
+                    }
+                } catch (error) {
+                    console.error("Не удалось разобрать ответ:", error);
+                } finally {
+                    // Следующий кадр — после ответа на предыдущий, даже если ответ не разобрался
+                    requestAnimationFrame(sendFrame);
+                }
+            };
+
             navigator.mediaDevices.getUserMedia({ video: true })
                 .then((stream) => {
                     video.srcObject = stream;
@@ -76,24 +157,20 @@ def get_camera_page():
                 canvas.width = video.videoWidth;
                 canvas.height = video.videoHeight;
                 ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-
-                const data = canvas.toDataURL("image/jpeg");
-
-                fetch("/detect", {
-                    method: "POST",
-                    headers: { "Content-Type": "application/json" },
-                    body: JSON.stringify({ image: data })
-                });
-
-                requestAnimationFrame(sendFrame);
-                setTimeout(sendFrame, 5);
+                canvas.toBlob((blob) => blob.arrayBuffer().then((buffer) => ws.send(buffer)), "image/jpeg");
             }
 
-            video.onloadeddata = () => sendFrame();
+            video.onloadeddata = () => {
+                if (ws.readyState === WebSocket.OPEN) {
+                    sendFrame();
+                } else {
+                    ws.onopen = () => sendFrame();
+                }
+            };
         </script>
     </body>
     </html>
-    """
+    """.replace("__MSGPACK_SCRIPT__", msgpack_script_tag())
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -103,8 +180,42 @@ async def websocket_endpoint(websocket: WebSocket):
             print("WS активен")
             await websocket.receive_text()
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         print("Клиент отключился")
+    finally:
+        manager.disconnect(websocket)
+
+
+@app.get("/ws/stats")
+def broadcast_stats():
+    return manager.metrics()
+
+
+@app.get("/models")
+def models_stats():
+    return engine.models.metrics()
+
+
+@app.post("/models/warmup")
+async def models_warmup():
+    # Прогрев в потоке, чтобы не блокировать event loop на время загрузки весов
+    loaded = await asyncio.get_running_loop().run_in_executor(None, engine.models.warmup, DETECT_MODELS)
+    return {"warmup_seconds": loaded, **engine.models.metrics()}
+
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = render()
+    if body is None:
+        return Response("prometheus_client не установлен", status_code=503, media_type=content_type)
+    return Response(body, media_type=content_type)
+
+
+@app.get("/detect/stats")
+def detect_stats():
+    return {
+        "motion": motion_gate.metrics(),
+        "scheduler": {**scheduler.stats, "average_batch": scheduler.average_batch()}
+    }
 
 CONFIDENCE_THRESHOLDS = {
     "firesmoke": {
@@ -124,37 +235,16 @@ import logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s") # логи
 
 
-def process_detections(results, model, frame, model_type, custom_threshold=None):
+def process_detections(results, frame, model_type, custom_threshold=None):
     logging.info(f"Обработка детекций для {model_type}...")
     detected_objects = []
-    thresholds = CONFIDENCE_THRESHOLDS.get(model_type, {})
-    class_counts = {}
-    max_confidences = {}
 
     start_time = time.time()
 
-    for result in results:
-        for box in result.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            cls = int(box.cls[0])
-            confidence = float(box.conf[0])
-            label = model.names[cls].lower()
-
-            min_confidence = custom_threshold if custom_threshold is not None else max(thresholds.get(label, 0.75),
-                                                                                       0.75)
-
-            if confidence >= min_confidence:
-                class_counts[label] = class_counts.get(label, 0) + 1
-                if label not in max_confidences or confidence > max_confidences[label]['confidence']:
-                    max_confidences[label] = {
-                        'bbox': [x1, y1, x2, y2],
-                        'confidence': confidence
-                    }
-
-    for label, data in max_confidences.items():
-        x1, y1, x2, y2 = data['bbox']
-        conf = data['confidence']
+    # Пороги, подсчёт и лучшая рамка на класс — целыми массивами (postprocess.py)
+    summary = summarize_detections(results, CONFIDENCE_THRESHOLDS.get(model_type, {}), custom_threshold)
 
+    for label, conf, (x1, y1, x2, y2), count in summary:
         cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
 
         text = f"{label} ({conf:.2f})"
@@ -164,7 +254,7 @@ def process_detections(results, model, frame, model_type, custom_threshold=None)
             "label": label,
             "confidence": conf,
             "bbox": [x1, y1, x2, y2],
-            "count": class_counts.get(label, 0)
+            "count": count
         })
 
         logging.info(f"Найден объект: {label} (conf: {conf:.2f}) в {x1, y1, x2, y2}")
@@ -175,95 +265,253 @@ def process_detections(results, model, frame, model_type, custom_threshold=None)
     return detected_objects, frame, inference_time
 
 
-@app.post("/detect")
-async def detect_objects(request: Request):
-    start_total = time.time()
-    data = await request.json()
-    image_data = data["image"].split(",")[1]
+def encode_alert_image(frame):
+    # JPEG кодируется один раз: сырые байты для бинарного канала, base64 для JSON-клиентов
+    with timed(STAGE_SECONDS.labels("encode")):
+        _, buffer = cv2.imencode(".jpg", frame)
+        jpeg = buffer.tobytes()
+        return jpeg, f"data:image/jpeg;base64,{base64.b64encode(jpeg).decode('utf-8')}"
 
-    image = np.frombuffer(base64.b64decode(image_data), dtype=np.uint8)
-    frame = cv2.imdecode(image, cv2.IMREAD_COLOR)
 
+def alert_candidates(results):
+    # Все рамки тревожных классов выше порога — для трекера
+    candidates = []
+    for result in results:
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            continue
+        for box, cls, conf in zip(boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy(), boxes.conf.cpu().numpy()):
+            label = result.names[int(cls)].lower()
+            if label in ALERT_LABELS and conf > ALERT_CONFIDENCE:
+                candidates.append((label, float(conf), [int(v) for v in box]))
+    return candidates
+
+
+async def analyze_frame(frame, client_id):
+    # Общая часть /detect и /ws/detect. Возвращает статистику кадра и JPEG с рамками, если была тревога.
+    # FrameDropped пробрасывается вызывающему
     logging.info("Началась обработка кадра...")
 
-    original_frame = frame.copy()
-
-    results = model_firesmoke(frame)
-    results2 = model_gun(frame)
+    # Статичная сцена: модели не запускаются, рамки берутся с последнего обработанного кадра
+    started = time.perf_counter()
+    if motion_gate.needs_inference(client_id, frame):
+        # Кадр ждёт своей пачки в планировщике; если клиент прислал более новый, этот отбрасывается
+        try:
+            outputs = await scheduler.submit(client_id, frame)
+        except FrameDropped:
+            motion_gate.reset(client_id)
+            FRAMES.labels("dropped").inc()
+            raise
+        motion_gate.update(client_id, outputs)
+        FRAMES.labels("inferred").inc()
+    else:
+        outputs = motion_gate.result(client_id)
+        FRAMES.labels("motion_skipped").inc()
+    # Ожидание пачки и инференс — отдельно от разбора рамок
+    inference_time = time.perf_counter() - started
+    STAGE_SECONDS.labels("scheduler").observe(inference_time)
+    results = [outputs["firesmoke"]]
+    results2 = [outputs["gunonly"]]
+    tracker = trackers.get(client_id)
 
     if results[0].boxes.shape[0] == 0 and results2[0].boxes.shape[0] == 0:
+        tracker.update([])
         logging.info("Объекты не найдены.")
-        return JSONResponse(content={"image": None, "stats": {}})
+        return {}, None, None
 
-    fire_objects, frame, fire_time = process_detections(results, model_firesmoke, frame, "firesmoke")
-    gun_objects, frame, gun_time = process_detections(results2, model_gun, frame, "gunonly")
+    fire_objects, frame, fire_time = process_detections(results, frame, "firesmoke")
+    gun_objects, frame, gun_time = process_detections(results2, frame, "gunonly")
+    STAGE_SECONDS.labels("postprocess").observe(fire_time + gun_time)
 
-    total_time = fire_time + gun_time
-    log_message = ""
-    combined_objects = {}
+    # Раньше здесь учитывался только разбор рамок; теперь время включает ожидание пачки и инференс
+    total_time = inference_time + fire_time + gun_time
     timestamp = int(time.time())
-
     all_objects = fire_objects + gun_objects
-    for obj in all_objects:
-        label = obj["label"].lower()
-        conf = obj["confidence"]
-
-        if (label == "pistol" or label == "pistol") and conf > 0.83:
-            _, buffer = cv2.imencode(".jpg", frame)
-            processed_image = base64.b64encode(buffer).decode("utf-8")
-            image_base64 = f"data:image/jpeg;base64,{processed_image}"
-
-            log_message = f"🔫 Pistol (conf: {conf:.2f}) ⏱ {total_time:.2f}s"
-
-            logging.info(f"⚠️ СРОЧНАЯ ОТПРАВКА: {log_message}")
-
-            await manager.broadcast({
-                "log": log_message,
-                "image": image_base64,
-                "counts": {"pistol": 1},
-                "timestamp": timestamp
-            })
-            return JSONResponse(content={
-                "image": image_base64,
-                "stats": {"processing_time": total_time, "counts": {"pistol": 1}, "timestamp": timestamp}
-            })
-
-        if conf > 0.80 and label in ["fire", "pistol"]:
-            if label not in combined_objects or conf > combined_objects[label]["confidence"]:
-                combined_objects[label] = obj
-
-    logging.info(f"Объекты, подлежащие отправке: {combined_objects}")
-
-    critical_objects = {} #PRE PROCESS ИСКЛЮЧАЕМ АУТЛАЕРЫ
-    for label in ["fire", "pistol"]:
-        if label in combined_objects and combined_objects[label]["confidence"] > 0.7:
-            if label not in critical_objects or combined_objects[label]["confidence"] > critical_objects[label]["confidence"]:
-                critical_objects[label] = combined_objects[label]
-
-    if critical_objects:
-        _, buffer = cv2.imencode(".jpg", frame)
-        processed_image = base64.b64encode(buffer).decode("utf-8")
-        image_base64 = f"data:image/jpeg;base64,{processed_image}"
 
-        log_message = " | ".join(
-            [f"{obj['label'].capitalize()} (conf: {obj['confidence']:.2f})" for obj in critical_objects.values()]
-        )
-        log_message = f"⏱ {total_time:.2f}s | {log_message}"
+    # Тревога только по новым трекам или при росте уверенности; та же сцена повторно не кодируется и не рассылается
+    alerts = tracker.update(alert_candidates(results) + alert_candidates(results2))
+    stats = {
+        "processing_time": total_time,
+        "counts": {},
+        "timestamp": timestamp,
+        "log": "",
+        "objects": all_objects
+    }
+    if not alerts:
+        logging.info("Новых тревог нет, кадр не рассылается.")
+        return stats, None, None
+
+    pistol = max((track for track in alerts if track.label == "pistol" and track.confidence > 0.83),
+                 key=lambda track: track.confidence, default=None)
+    if pistol is not None:
+        jpeg, image_base64 = encode_alert_image(frame)
+
+        log_message = f"🔫 Pistol (conf: {pistol.confidence:.2f}) ⏱ {total_time:.2f}s"
+        ALERTS.labels("pistol").inc()
 
-        logging.info(f"Отправка данных: {log_message}")
+        logging.info(f"⚠️ СРОЧНАЯ ОТПРАВКА: {log_message}")
 
         await manager.broadcast({
             "log": log_message,
             "image": image_base64,
-            "counts": {k: 1 for k in critical_objects},
-            "timestamp": timestamp
+            "counts": {"pistol": 1},
+            "timestamp": timestamp,
+            "source": client_id,
+            "tracks": [pistol.to_dict()]
         })
+        # Остальные треки не разосланы — тревога по ним уйдёт со следующим кадром
+        tracker.mark_alerted([pistol])
+        stats.update(counts={"pistol": 1}, log=log_message)
+        return stats, jpeg, image_base64
+
+    critical_objects = {}
+    for track in alerts:
+        if track.label not in critical_objects or track.confidence > critical_objects[track.label].confidence:
+            critical_objects[track.label] = track
+
+    jpeg, image_base64 = encode_alert_image(frame)
+
+    log_message = " | ".join(
+        [f"{track.label.capitalize()} (conf: {track.confidence:.2f})" for track in critical_objects.values()]
+    )
+    log_message = f"⏱ {total_time:.2f}s | {log_message}"
+    for label in critical_objects:
+        ALERTS.labels(label).inc()
+
+    logging.info(f"Отправка данных: {log_message}")
+
+    await manager.broadcast({
+        "log": log_message,
+        "image": image_base64,
+        "counts": {k: 1 for k in critical_objects},
+        "timestamp": timestamp,
+        "source": client_id,
+        "tracks": [track.to_dict() for track in alerts]
+    })
+    tracker.mark_alerted(alerts)
+
+    stats.update(counts={k: 1 for k in critical_objects}, log=log_message)
+    return stats, jpeg, image_base64
+
+
+@app.post("/detect")
+async def detect_objects(request: Request):
+    data = await request.json()
+    image_data = data["image"].split(",")[1]
+
+    with timed(STAGE_SECONDS.labels("decode")):
+        image = np.frombuffer(base64.b64decode(image_data), dtype=np.uint8)
+        frame = cv2.imdecode(image, cv2.IMREAD_COLOR)
+
+    # Без client_id запрос — отдельный поток: по адресу не склеиваем, за NAT или прокси он общий у разных клиентов
+    client_id = data.get("client_id")
+    one_off = not client_id
+    if one_off:
+        client_id = f"detect-{uuid.uuid4().hex}"
+    try:
+        stats, _, image_base64 = await analyze_frame(frame, client_id)
+    except FrameDropped:
+        return JSONResponse(content={"image": None, "stats": {}, "dropped": True})
+    finally:
+        if one_off:
+            forget_stream(client_id)
+    if not stats:
+        return JSONResponse(content={"image": None, "stats": {}})
 
     return JSONResponse(content={
-        "image": image_base64 if log_message else None,
-        "stats": {
-            "processing_time": total_time,
-            "counts": {k: 1 for k in critical_objects},
-            "timestamp": timestamp
-        }
+        "image": image_base64,
+        "stats": {key: stats[key] for key in ("processing_time", "counts", "timestamp")}
     })
+
+
+# Бинарный протокол /ws/detect.
+# Клиент -> сервер: бинарное сообщение = байты JPEG кадра.
+# Сервер -> клиент: первый байт — тип, дальше тело:
+#   0x01 — результат в msgpack, 0x03 — результат в JSON (если msgpack не установлен или клиент
+#   подключился с ?format=json),
+#   0x02 — JPEG с рамками, приходит следом за результатом только при тревоге.
+MSG_RESULT_MSGPACK = b"\x01"
+MSG_IMAGE = b"\x02"
+MSG_RESULT_JSON = b"\x03"
+
+
+def encode_result(result, use_msgpack=True):
+    if use_msgpack and msgpack is not None:
+        return MSG_RESULT_MSGPACK + msgpack.packb(result, use_bin_type=True)
+    return MSG_RESULT_JSON + json.dumps(result, ensure_ascii=False).encode("utf-8")
+
+
+@app.websocket("/ws/detect")
+async def detect_stream(websocket: WebSocket):
+    await websocket.accept()
+    # id(websocket) переиспользуется после сборки мусора — новый клиент получил бы чужой трек
+    client_id = f"ws-{uuid.uuid4().hex}"
+    use_msgpack = websocket.query_params.get("format") != "json"
+    try:
+        while True:
+            payload = await websocket.receive_bytes()
+            with timed(STAGE_SECONDS.labels("decode")):
+                frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                await websocket.send_bytes(encode_result({"error": "bad frame"}, use_msgpack))
+                continue
+            try:
+                stats, jpeg, _ = await analyze_frame(frame, client_id)
+            except FrameDropped:
+                await websocket.send_bytes(encode_result({"dropped": True}, use_msgpack))
+                continue
+            await websocket.send_bytes(encode_result({"stats": stats, "alert": jpeg is not None}, use_msgpack))
+            if jpeg is not None:
+                await websocket.send_bytes(MSG_IMAGE + jpeg)
+    except WebSocketDisconnect:
+        logging.info("Клиент /ws/detect отключился")
+    finally:
+        forget_stream(client_id)
+
+
+# КАМЕРЫ: RTSP-потоки и видеофайлы разбираются сервером, тревоги уходят зрителям /ws
+def forget_stream(stream_id):
+    motion_gate.forget(stream_id)
+    trackers.forget(stream_id)
+
+
+cameras = CameraManager(analyze_frame, default_fps=float(os.environ.get("CAMERA_FPS", 5)), forget=forget_stream)
+CAMERAS_FILE = os.environ.get("CAMERAS_FILE", "cameras.json")
+
+
+@app.on_event("startup")
+async def start_cameras():
+    if os.path.exists(CAMERAS_FILE):
+        cameras.load(CAMERAS_FILE)
+
+
+@app.on_event("shutdown")
+async def stop_cameras():
+    await cameras.close()
+
+
+@app.get("/cameras")
+def cameras_stats():
+    return cameras.metrics()
+
+
+@app.post("/cameras")
+async def add_camera(request: Request):
+    data = await request.json()
+    if not data.get("name") or not data.get("url"):
+        return JSONResponse(status_code=400, content={"error": "нужны name и url"})
+    fps = data.get("fps")
+    if fps is not None and not valid_fps(fps):
+        return JSONResponse(status_code=400, content={"error": "fps должен быть положительным числом"})
+    try:
+        cameras.add(data["name"], data["url"], fps)
+    except ValueError as e:
+        return JSONResponse(status_code=409, content={"error": str(e)})
+    return cameras.metrics()[data["name"]]
+
+
+@app.delete("/cameras/{name}")
+async def remove_camera(name: str):
+    if not await cameras.remove(name):
+        return JSONResponse(status_code=404, content={"error": "камера не найдена"})
+    return {"removed": name}
@@ -0,0 +1,116 @@
+import argparse
+import time
+from functools import lru_cache
+from types import SimpleNamespace
+
+import numpy as np
+
+# Разбор детекций целыми массивами: пороги по классам, подсчёт и лучшая рамка на класс
+# считаются в NumPy без цикла по рамкам. Результат совпадает с прежним построчным разбором:
+# порядок классов — по первой прошедшей порог рамке, координаты усечены до int.
+
+DEFAULT_CONFIDENCE = 0.75
+
+
+@lru_cache(maxsize=64)
+def class_tables(names, thresholds, custom_threshold):
+    # names: кортеж (id класса, имя), thresholds: кортеж (метка, порог)
+    thresholds = dict(thresholds)
+    labels = sorted({name.lower() for _, name in names})
+    size = max(class_id for class_id, _ in names) + 1
+    label_index = np.zeros(size, dtype=np.intp)
+    # float64, как и пороги из Python: в float32 порог вроде 0.7 округляется вниз и пропускает лишнее
+    min_confidence = np.ones(size, dtype=np.float64)
+    for class_id, name in names:
+        label = name.lower()
+        label_index[class_id] = labels.index(label)
+        min_confidence[class_id] = (custom_threshold if custom_threshold is not None
+                                    else max(thresholds.get(label, DEFAULT_CONFIDENCE), DEFAULT_CONFIDENCE))
+    return labels, label_index, min_confidence
+
+
+def summarize_detections(results, thresholds=None, custom_threshold=None):
+    # Возвращает [(метка, уверенность, [x1, y1, x2, y2], количество)] — по одной записи на класс
+    xyxy, cls, conf = [], [], []
+    names = None
+    for result in results:
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            continue
+        names = result.names
+        xyxy.append(boxes.xyxy.cpu().numpy())
+        cls.append(boxes.cls.cpu().numpy().astype(np.intp))
+        conf.append(boxes.conf.cpu().numpy())
+    if names is None:
+        return []
+
+    labels, label_index, min_confidence = class_tables(
+        tuple(sorted(names.items())), tuple(sorted((thresholds or {}).items())), custom_threshold
+    )
+    xyxy, cls, conf = np.concatenate(xyxy), np.concatenate(cls), np.concatenate(conf)
+    keep = conf >= min_confidence[cls]
+    if not keep.any():
+        return []
+    xyxy, conf, index = xyxy[keep], conf[keep], label_index[cls[keep]]
+
+    counts = np.bincount(index, minlength=len(labels))
+    # Лучшая рамка на класс: сортировка по классу, затем по убыванию уверенности, при равенстве — первая
+    order = np.lexsort((np.arange(len(index)), -conf, index))
+    best = order[np.r_[True, index[order][1:] != index[order][:-1]]]
+    present, first_seen = np.unique(index, return_index=True)
+    boxes = xyxy[best].astype(int)
+    return [
+        (labels[present[i]], float(conf[best[i]]), boxes[i].tolist(), int(counts[present[i]]))
+        for i in np.argsort(first_seen, kind="stable")
+    ]
+
+
+def summarize_detections_loop(results, thresholds=None, custom_threshold=None):
+    # Прежний построчный разбор, оставлен для сверки и замера
+    thresholds = thresholds or {}
+    class_counts = {}
+    max_confidences = {}
+    for result in results:
+        for box in result.boxes:
+            x1, y1, x2, y2 = map(int, box.xyxy[0])
+            cls = int(box.cls[0])
+            confidence = float(box.conf[0])
+            label = result.names[cls].lower()
+            min_confidence = custom_threshold if custom_threshold is not None else max(
+                thresholds.get(label, DEFAULT_CONFIDENCE), DEFAULT_CONFIDENCE)
+            if confidence >= min_confidence:
+                class_counts[label] = class_counts.get(label, 0) + 1
+                if label not in max_confidences or confidence > max_confidences[label][0]:
+                    max_confidences[label] = (confidence, [x1, y1, x2, y2])
+    return [(label, conf, bbox, class_counts[label]) for label, (conf, bbox) in max_confidences.items()]
+
+
+def synthetic_results(boxes_count, classes=80, seed=0):
+    import torch
+    from ultralytics.engine.results import Boxes
+
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 1200, (boxes_count, 2))
+    data = np.column_stack([xy, xy + rng.uniform(10, 200, (boxes_count, 2)),
+                            rng.uniform(0.3, 1.0, boxes_count), rng.integers(0, classes, boxes_count)])
+    names = {i: ("person" if i == 0 else f"class{i}") for i in range(classes)}
+    return [SimpleNamespace(boxes=Boxes(torch.tensor(data, dtype=torch.float32), (1440, 1440)), names=names)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер разбора детекций: цикл по рамкам против NumPy")
+    parser.add_argument("--boxes", default="10,100,300,1000")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    for boxes_count in [int(b) for b in args.boxes.split(",")]:
+        results = synthetic_results(boxes_count)
+        assert summarize_detections(results) == summarize_detections_loop(results)
+        timings = []
+        for summarize in (summarize_detections_loop, summarize_detections):
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                summarize(results)
+            timings.append((time.perf_counter() - started) / args.repeat * 1000)
+        print(f"{boxes_count:>5} рамок  цикл {timings[0]:8.3f} мс  numpy {timings[1]:7.3f} мс  "
+              f"ускорение x{timings[0] / timings[1]:.1f}")
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from runtime import load_model, runtime_config
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Реестр моделей: модель грузится при первом обращении, а не при импорте приложения.
+# Если файл весов (.pt/.onnx) поменялся на диске, модель перезагружается без рестарта:
+# загрузка (включая повторный экспорт в ONNX/OpenVINO) идёт в фоновом потоке, запросы тем временем
+# обслуживает старая версия, затем ссылка подменяется.
+# Реестр ведёт себя как словарь имя -> модель, поэтому InferenceEngine работает с ним как раньше.
+
+
+def resident_memory():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+class ModelEntry:
+    def __init__(self, name, weights):
+        self.name = name
+        self.weights = weights
+        self.model = None
+        self.path = None
+        self.mtime = None
+        self.lock = threading.Lock()
+        self.loads = 0
+        self.load_time = 0.0
+        self.memory = 0
+        self.loaded_at = None
+        self.last_check = 0.0
+        self.error = None
+
+    def metrics(self):
+        return {
+            "weights": self.weights,
+            "path": self.path,
+            "loaded": self.model is not None,
+            "loads": self.loads,
+            "load_time": round(self.load_time, 3),
+            "resident_memory_mb": round(self.memory / 2 ** 20, 1),
+            "loaded_at": self.loaded_at,
+            "error": self.error
+        }
+
+
+class ModelRegistry:
+    def __init__(self, files, config=None, reload_interval=None):
+        # reload_interval — как часто (с) проверять mtime весов; 0 отключает горячую перезагрузку
+        self.config = config or runtime_config()
+        self.reload_interval = (float(os.environ.get("MODEL_RELOAD_INTERVAL", 10))
+                                if reload_interval is None else reload_interval)
+        self.entries = {name: ModelEntry(name, weights) for name, weights in files.items()}
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __getitem__(self, name):
+        entry = self.entries[name]
+        if entry.model is None:
+            # Первая загрузка: остальные потоки ждут её завершения
+            with entry.lock:
+                if entry.model is None:
+                    self._load(entry)
+        elif self.reload_interval and time.monotonic() - entry.last_check >= self.reload_interval:
+            entry.last_check = time.monotonic()
+            if self._changed(entry) and entry.lock.acquire(blocking=False):
+                threading.Thread(target=self._reload, args=(entry,), daemon=True,
+                                 name=f"reload-{name}").start()
+        return entry.model
+
+    def _reload(self, entry):
+        # Блокировка взята в __getitem__ и снимается здесь, когда новая версия готова
+        try:
+            self._load(entry, warmup=True)
+        finally:
+            entry.lock.release()
+
+    def _changed(self, entry):
+        try:
+            return os.path.getmtime(entry.weights) != entry.mtime
+        except OSError:
+            return False
+
+    def _load(self, entry, warmup=False):
+        mtime = os.path.getmtime(entry.weights)
+        memory_before = resident_memory()
+        started = time.perf_counter()
+        try:
+            model, path = load_model(entry.weights, self.config)
+            if warmup:
+                # Инициализация предиктора тоже до подмены, а не на первом запросе
+                imgsz = self.config["imgsz"]
+                model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), verbose=False)
+        except Exception as e:
+            entry.error = str(e)
+            if entry.model is None:
+                raise
+            print(f"Не удалось перезагрузить {entry.name}, работает прежняя версия: {e}")
+            entry.mtime = mtime
+            return
+        entry.load_time = time.perf_counter() - started
+        entry.memory = max(0, resident_memory() - memory_before)
+        entry.path, entry.mtime, entry.error = path, mtime, None
+        entry.loads += 1
+        entry.loaded_at = time.time()
+        entry.last_check = time.monotonic()
+        entry.model = model
+        print(f"Модель {entry.name} загружена из {path} за {entry.load_time:.2f} с "
+              f"(+{entry.memory / 2 ** 20:.0f} МБ)")
+
+    def warmup(self, names=None, imgsz=None):
+        # Загрузка и один прогон на пустом кадре, чтобы первый запрос не платил за инициализацию предиктора
+        imgsz = imgsz or self.config["imgsz"]
+        frame = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+        report = {}
+        for name in names or list(self.entries):
+            started = time.perf_counter()
+            self[name](frame, verbose=False)
+            report[name] = round(time.perf_counter() - started, 3)
+        return report
+
+    def freeze(self):
+        # Перед fork: веса torch только для чтения, чтобы страницы тензоров оставались общими (copy-on-write)
+        for entry in self.entries.values():
+            module = getattr(entry.model, "model", None)
+            if hasattr(module, "parameters"):
+                module.eval()
+                for parameter in module.parameters():
+                    parameter.requires_grad_(False)
+
+    def metrics(self):
+        return {
+            "runtime": self.config["runtime"],
+            "int8": self.config["int8"],
+            "resident_memory_mb": round(resident_memory() / 2 ** 20, 1),
+            "models": {name: entry.metrics() for name, entry in self.entries.items()}
+        }
@@ -0,0 +1,322 @@
+import argparse
+import fcntl
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+# Слой выбора рантайма моделей. Веса *.pt экспортируются в ONNX или OpenVINO (по желанию с INT8),
+# экспорт кешируется в EXPORT_DIR. Ultralytics грузит экспортированные модели тем же классом YOLO,
+# поэтому Results и формат process_detections не меняются.
+#
+# MODEL_RUNTIME          torch | onnx | openvino
+# MODEL_INT8             1 — INT8-квантизация, калибровка на изображениях из MODEL_CALIBRATION_DIR
+# MODEL_THREADS          число потоков инференса на процесс (0 — по умолчанию рантайма)
+# MODEL_IMGSZ            размер входа при экспорте
+
+RUNTIMES = ("torch", "onnx", "openvino")
+EXPORT_DIR = os.environ.get("MODEL_EXPORT_DIR", "exported")
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp")
+
+
+def runtime_config():
+    return {
+        "runtime": os.environ.get("MODEL_RUNTIME", "torch"),
+        "int8": os.environ.get("MODEL_INT8", "0") == "1",
+        "threads": int(os.environ.get("MODEL_THREADS", 0)),
+        "calibration_dir": os.environ.get("MODEL_CALIBRATION_DIR"),
+        "imgsz": int(os.environ.get("MODEL_IMGSZ", 640))
+    }
+
+
+def apply_threads(threads):
+    # Только torch: у onnxruntime и OpenVINO свои пулы потоков, их размер задаёт configure_session
+    if threads > 0:
+        torch.set_num_threads(threads)
+
+
+def configure_session(model, path, runtime, threads):
+    # Ultralytics создаёт сессию onnxruntime и компилирует модель OpenVINO без настроек потоков.
+    # Пустой кадр создаёт AutoBackend, после чего сессия пересоздаётся с нужным числом потоков
+    if threads <= 0 or runtime == "torch":
+        return
+    if model.predictor is None:
+        model(np.zeros((64, 64, 3), dtype=np.uint8), verbose=False)
+    backend = model.predictor.model
+    if runtime == "onnx":
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        backend.session = onnxruntime.InferenceSession(path, sess_options=options,
+                                                       providers=backend.session.get_providers())
+        return
+    try:
+        from openvino import Core
+    except ImportError:
+        from openvino.runtime import Core
+    core = Core()
+    xml = glob.glob(os.path.join(path, "*.xml"))[0]
+    compiled = core.compile_model(core.read_model(xml), "CPU", {"INFERENCE_NUM_THREADS": threads})
+    # Имя атрибута в AutoBackend менялось между версиями Ultralytics
+    if hasattr(backend, "ov_compiled_model"):
+        backend.ov_compiled_model = compiled
+    else:
+        backend.executable_network = compiled
+
+
+def calibration_images(calibration_dir, limit=300):
+    paths = sorted(path for pattern in IMAGE_PATTERNS for path in glob.glob(os.path.join(calibration_dir, pattern)))
+    return paths[:limit]
+
+
+def exported_path(weights, runtime, int8):
+    stem = os.path.splitext(os.path.basename(weights))[0] + ("_int8" if int8 else "")
+    if runtime == "onnx":
+        return os.path.join(EXPORT_DIR, f"{stem}.onnx")
+    # Ultralytics распознаёт формат OpenVINO по суффиксу каталога
+    return os.path.join(EXPORT_DIR, f"{stem}_openvino_model")
+
+
+def letterbox(frame, imgsz):
+    height, width = frame.shape[:2]
+    scale = min(imgsz / height, imgsz / width)
+    resized = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top = (imgsz - resized.shape[0]) // 2
+    left = (imgsz - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return canvas
+
+
+def quantize_onnx(fp32_path, int8_path, calibration_dir, imgsz):
+    # Статическая INT8-квантизация onnxruntime, калибровка на локальных кадрах с той же предобработкой, что у YOLO
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = onnx.load(fp32_path, load_external_data=False).graph.input[0].name
+    images = calibration_images(calibration_dir)
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(images)
+
+        def get_next(self):
+            for path in self.paths:
+                frame = cv2.imread(path)
+                if frame is None:
+                    continue
+                blob = letterbox(frame, imgsz)[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+                return {input_name: blob}
+            return None
+
+    quantize_static(fp32_path, int8_path, Reader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    # Метаданные (имена классов, stride) нужны Ultralytics для загрузки модели
+    source, target = onnx.load(fp32_path), onnx.load(int8_path)
+    del target.metadata_props[:]
+    target.metadata_props.extend(source.metadata_props)
+    onnx.save(target, int8_path)
+
+
+def is_exported(target, weights):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(weights)
+
+
+def export_model(weights, runtime, int8=False, calibration_dir=None, imgsz=640):
+    target = exported_path(weights, runtime, int8)
+    if is_exported(target, weights):
+        return target
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    # Процессы видео и воркеры uvicorn стартуют одновременно: экспортирует один, остальные ждут блокировку
+    # и берут готовый файл. Результат появляется под своим именем только целиком
+    with open(target + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if is_exported(target, weights):
+            return target
+        _export(weights, runtime, target, int8, calibration_dir, imgsz)
+    return target
+
+
+def _export(weights, runtime, target, int8, calibration_dir, imgsz):
+    print(f"Экспорт {weights} -> {target}")
+    partial = f"{target}.partial"
+    model = YOLO(weights)
+
+    if runtime == "onnx":
+        fp32_path = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+        if int8:
+            quantize_onnx(fp32_path, partial, calibration_dir, imgsz)
+            os.remove(fp32_path)
+        else:
+            shutil.move(fp32_path, partial)
+        os.replace(partial, target)
+        return
+
+    calibration_yaml = None
+    try:
+        if int8:
+            # Ultralytics калибрует OpenVINO (NNCF) по датасету: описываем каталог с кадрами как val-выборку
+            with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as calibration_yaml:
+                json.dump({
+                    "path": os.path.abspath(calibration_dir),
+                    "train": ".",
+                    "val": ".",
+                    "names": model.names
+                }, calibration_yaml)
+        exported = model.export(format="openvino", imgsz=imgsz, dynamic=True, int8=int8,
+                                data=calibration_yaml.name if calibration_yaml else None)
+    finally:
+        if calibration_yaml is not None:
+            os.remove(calibration_yaml.name)
+    # Каталог целиком не подменить атомарно: старый убирается, готовый переименовывается под блокировкой
+    shutil.rmtree(partial, ignore_errors=True)
+    shutil.move(exported, partial)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(partial, target)
+
+
+def resolve_model_files(files, runtime="torch", int8=False, calibration_dir=None, imgsz=640):
+    # Имя модели -> путь к весам выбранного рантайма, экспорт при первом запуске
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Неизвестный рантайм {runtime}, доступны: {', '.join(RUNTIMES)}")
+    if runtime == "torch":
+        return dict(files)
+    if int8 and not (calibration_dir and calibration_images(calibration_dir)):
+        print(f"Нет изображений для калибровки INT8 в {calibration_dir}, экспорт без квантизации")
+        int8 = False
+    return {name: export_model(weights, runtime, int8, calibration_dir, imgsz) for name, weights in files.items()}
+
+
+def load_model(weights, config=None):
+    # Возвращает модель и путь, из которого она фактически загружена
+    config = config or runtime_config()
+    apply_threads(config["threads"])
+    path = resolve_model_files({"model": weights}, config["runtime"], config["int8"],
+                               config["calibration_dir"], config["imgsz"])["model"]
+    model = YOLO(path, task="detect")
+    configure_session(model, path, config["runtime"], config["threads"])
+    return model, path
+
+
+def load_models(files, config=None):
+    return {name: load_model(weights, config)[0] for name, weights in files.items()}
+
+
+# Сравнение точности и задержки: эталон — исходная модель torch FP32,
+# для каждого варианта считается совпадение детекций с эталоном (IoU >= 0.5, тот же класс).
+
+def box_iou(a, b):
+    x1, y1 = np.maximum(a[:, None, 0], b[None, :, 0]), np.maximum(a[:, None, 1], b[None, :, 1])
+    x2, y2 = np.minimum(a[:, None, 2], b[None, :, 2]), np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def detections(result):
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 4)), np.zeros(0, dtype=int), np.zeros(0)
+    return boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy().astype(int), boxes.conf.cpu().numpy()
+
+
+def agreement(reference, candidate, iou_threshold=0.5):
+    ref_boxes, ref_cls, ref_conf = detections(reference)
+    boxes, cls, conf = detections(candidate)
+    if len(ref_boxes) == 0 or len(boxes) == 0:
+        return 0, len(ref_boxes), len(boxes), []
+    overlaps = box_iou(ref_boxes, boxes) * (ref_cls[:, None] == cls[None, :])
+    matched, conf_deltas, used = 0, [], set()
+    for ri in np.argsort(-ref_conf):
+        order = [ci for ci in np.argsort(-overlaps[ri]) if ci not in used and overlaps[ri, ci] >= iou_threshold]
+        if order:
+            used.add(order[0])
+            matched += 1
+            conf_deltas.append(float(conf[order[0]] - ref_conf[ri]))
+    return matched, len(ref_boxes), len(boxes), conf_deltas
+
+
+def compare(files, images_dir, variants, imgsz=640, calibration_dir=None, limit=200, threads=0):
+    frames = [frame for frame in (cv2.imread(path) for path in calibration_images(images_dir, limit)) if frame is not None]
+    if not frames:
+        raise ValueError(f"В {images_dir} нет изображений")
+    reference = {}
+    report = []
+    for runtime, int8 in variants:
+        paths = resolve_model_files(files, runtime, int8, calibration_dir or images_dir, imgsz)
+        for name, path in paths.items():
+            model = YOLO(path, task="detect")
+            model(frames[0], verbose=False)  # прогрев
+            configure_session(model, path, runtime, threads)
+            started = time.perf_counter()
+            results = [model(frame, verbose=False)[0] for frame in frames]
+            latency = (time.perf_counter() - started) / len(frames) * 1000
+            row = {"model": name, "runtime": runtime, "int8": int8, "latency_ms": round(latency, 2)}
+            if name not in reference:
+                reference[name] = results
+            matched = ref_total = total = 0
+            deltas = []
+            for ref_result, result in zip(reference[name], results):
+                m, r, t, d = agreement(ref_result, result)
+                matched, ref_total, total = matched + m, ref_total + r, total + t
+                deltas.extend(d)
+            row["recall_vs_fp32"] = round(matched / ref_total, 4) if ref_total else 1.0
+            row["precision_vs_fp32"] = round(matched / total, 4) if total else 1.0
+            row["mean_conf_delta"] = round(float(np.mean(deltas)), 4) if deltas else 0.0
+            report.append(row)
+            print(f"{name:<10} {runtime:<9} {'int8' if int8 else 'fp32':<5} {latency:8.2f} мс/кадр  "
+                  f"recall {row['recall_vs_fp32']:.3f}  precision {row['precision_vs_fp32']:.3f}  "
+                  f"Δconf {row['mean_conf_delta']:+.3f}")
+    return report
+
+
+if __name__ == "__main__":
+    from inference import MODEL_FILES
+
+    parser = argparse.ArgumentParser(description="Экспорт моделей в ONNX/OpenVINO и сравнение рантаймов на CPU")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("--runtime", choices=RUNTIMES[1:], required=True)
+    export_parser.add_argument("--int8", action="store_true")
+    export_parser.add_argument("--calibration-dir")
+    export_parser.add_argument("--imgsz", type=int, default=640)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("images")
+    compare_parser.add_argument("--variants", default="torch,onnx,onnx:int8,openvino,openvino:int8")
+    compare_parser.add_argument("--calibration-dir")
+    compare_parser.add_argument("--imgsz", type=int, default=640)
+    compare_parser.add_argument("--limit", type=int, default=200)
+    compare_parser.add_argument("--threads", type=int, default=0)
+    compare_parser.add_argument("--json")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        for name, path in resolve_model_files(MODEL_FILES, args.runtime, args.int8,
+                                              args.calibration_dir, args.imgsz).items():
+            print(f"{name}: {path}")
+    else:
+        apply_threads(args.threads)
+        variants = []
+        for variant in args.variants.split(","):
+            runtime, _, precision = variant.partition(":")
+            variants.append((runtime, precision == "int8"))
+        # Эталон torch FP32 всегда идёт первым
+        if variants[0] != ("torch", False):
+            variants.insert(0, ("torch", False))
+        report = compare(MODEL_FILES, args.images, variants, args.imgsz, args.calibration_dir, args.limit,
+                         args.threads)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,91 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Микро-батчинг запросов на инференс: кадры копятся в очереди не дольше max_delay,
+# пачка уходит в пул потоков, event loop не блокируется.
+# У каждого клиента в очереди не больше одного кадра: новый кадр вытесняет старый.
+
+
+class FrameDropped(Exception):
+    pass
+
+
+class BatchScheduler:
+    def __init__(self, infer, max_batch=8, max_delay=0.02, workers=1):
+        # infer(frames) -> список результатов той же длины; вызывается в потоке пула
+        self.infer = infer
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = asyncio.Semaphore(workers)
+        self.pending = OrderedDict()
+        self.ready = asyncio.Event()
+        self.task = None
+        self.stats = {
+            "submitted": 0,
+            "dropped": 0,
+            "batches": 0,
+            "frames": 0
+        }
+
+    async def submit(self, client_id, frame):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        stale = self.pending.pop(client_id, None)
+        if stale is not None and not stale[1].done():
+            stale[1].set_exception(FrameDropped())
+            self.stats["dropped"] += 1
+        self.pending[client_id] = (frame, future)
+        self.stats["submitted"] += 1
+        self.ready.set()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.ready.wait()
+            # Добираем пачку в пределах бюджета задержки
+            deadline = loop.time() + self.max_delay
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self.ready.clear()
+                try:
+                    await asyncio.wait_for(self.ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+            batch = [self.pending.popitem(last=False) for _ in range(min(self.max_batch, len(self.pending)))]
+            if self.pending:
+                self.ready.set()
+            else:
+                self.ready.clear()
+            asyncio.create_task(self._execute(batch))
+
+    async def _execute(self, batch):
+        futures = [future for _, (_, future) in batch]
+        try:
+            frames = [frame for _, (frame, _) in batch]
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.infer, frames)
+            self.stats["batches"] += 1
+            self.stats["frames"] += len(frames)
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    def average_batch(self):
+        return self.stats["frames"] / self.stats["batches"] if self.stats["batches"] else 0.0
+
+    def shutdown(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
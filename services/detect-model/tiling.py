@@ -0,0 +1,208 @@
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+import torch
+from torchvision.ops import batched_nms
+from ultralytics.engine.results import Results
+
+# Плиточный инференс (как в SAHI) для мелких объектов на больших кадрах: кадр режется на
+# перекрывающиеся плитки размера входа модели, плитки идут в модель одной пачкой,
+# рамки переводятся в координаты кадра и сливаются межплиточным NMS вместе с рамками полного кадра.
+#
+# TILE_MODE     off — выключено, full — все плитки, coarse — только плитки вокруг
+#               рамок грубого прохода по всему кадру с низким порогом
+# TILE_SIZE     сторона плитки в пикселях
+# TILE_OVERLAP  доля перекрытия соседних плиток
+# TILE_MODELS   модели, для которых включены плитки
+
+TILE_MODES = ("off", "full", "coarse")
+
+
+def tile_grid(width, height, tile, overlap):
+    step = max(1, int(tile * (1 - overlap)))
+
+    def starts(size):
+        if size <= tile:
+            return [0]
+        positions = list(range(0, size - tile, step))
+        return positions + [size - tile]  # последняя плитка прижата к краю
+
+    return [(x, y, min(x + tile, width), min(y + tile, height)) for y in starts(height) for x in starts(width)]
+
+
+def select_tiles(grid, boxes, margin=0):
+    # Плитки, пересекающие хотя бы одну рамку грубого прохода
+    if len(boxes) == 0:
+        return []
+    tiles = np.asarray(grid, dtype=np.float32)
+    boxes = np.asarray(boxes, dtype=np.float32)
+    overlap_x = (tiles[:, None, 0] < boxes[None, :, 2] + margin) & (tiles[:, None, 2] > boxes[None, :, 0] - margin)
+    overlap_y = (tiles[:, None, 1] < boxes[None, :, 3] + margin) & (tiles[:, None, 3] > boxes[None, :, 1] - margin)
+    return [grid[i] for i in np.flatnonzero((overlap_x & overlap_y).any(axis=1))]
+
+
+class TiledPredictor:
+    def __init__(self, mode="full", tile=640, overlap=0.2, models=None, conf=0.25, coarse_conf=0.05, iou=0.5):
+        self.mode = mode
+        self.tile = tile
+        self.overlap = overlap
+        self.models = set(models) if models else None
+        self.conf = conf
+        self.coarse_conf = coarse_conf
+        self.iou = iou
+        self.stats = {"frames": 0, "tiles": 0}
+
+    @classmethod
+    def from_env(cls):
+        mode = os.environ.get("TILE_MODE", "off")
+        if mode not in TILE_MODES:
+            raise ValueError(f"Неизвестный TILE_MODE {mode}, доступны: {', '.join(TILE_MODES)}")
+        if mode == "off":
+            return None
+        return cls(
+            mode=mode,
+            tile=int(os.environ.get("TILE_SIZE", 640)),
+            overlap=float(os.environ.get("TILE_OVERLAP", 0.2)),
+            models=[name for name in os.environ.get("TILE_MODELS", "firesmoke,gunonly").split(",") if name]
+        )
+
+    def applies_to(self, name):
+        return self.models is None or name in self.models
+
+    def predict(self, model, frame):
+        height, width = frame.shape[:2]
+        # Грубый проход по всему кадру: крупные объекты и выбор плиток.
+        # Низкий порог нужен только для выбора плиток — кадр меньше плитки идёт с обычным
+        tiled = max(height, width) > self.tile
+        full = model(frame, verbose=False, conf=self.coarse_conf if self.mode == "coarse" and tiled else self.conf)[0]
+        if not tiled:
+            return full
+
+        grid = tile_grid(width, height, self.tile, self.overlap)
+        full_xyxy = full.boxes.xyxy.cpu()
+        full_conf = full.boxes.conf.cpu()
+        full_cls = full.boxes.cls.cpu()
+        if self.mode == "coarse":
+            grid = select_tiles(grid, full_xyxy.numpy(), margin=self.tile * self.overlap / 2)
+            confident = full_conf >= self.conf
+            full_xyxy, full_conf, full_cls = full_xyxy[confident], full_conf[confident], full_cls[confident]
+
+        xyxy, conf, cls = [full_xyxy], [full_conf], [full_cls]
+        if grid:
+            crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in grid]
+            for (x1, y1, _, _), result in zip(grid, model(crops, verbose=False, conf=self.conf)):
+                boxes = result.boxes
+                if boxes is None or len(boxes) == 0:
+                    continue
+                xyxy.append(boxes.xyxy.cpu() + torch.tensor([x1, y1, x1, y1], dtype=torch.float32))
+                conf.append(boxes.conf.cpu())
+                cls.append(boxes.cls.cpu())
+        self.stats["frames"] += 1
+        self.stats["tiles"] += len(grid)
+
+        xyxy, conf, cls = torch.cat(xyxy), torch.cat(conf), torch.cat(cls)
+        # Межплиточный NMS по каждому классу отдельно
+        keep = batched_nms(xyxy, conf, cls.long(), self.iou)
+        data = torch.cat([xyxy[keep], conf[keep, None], cls[keep, None]], dim=1)
+        return Results(frame, path="", names=model.names, boxes=data)
+
+
+# Замер полноты и задержки на размеченной выборке в формате YOLO:
+# images/*.jpg и labels/*.txt (класс cx cy w h, нормированные)
+
+def load_labels(label_path, width, height):
+    if not os.path.exists(label_path):
+        return np.zeros((0, 5))
+    rows = np.loadtxt(label_path, ndmin=2)
+    if rows.size == 0:
+        return np.zeros((0, 5))
+    cls, cx, cy, w, h = rows[:, 0], rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+    return np.column_stack([cls, cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+
+def match(truth, result, iou_threshold=0.5):
+    from runtime import box_iou
+
+    boxes = result.boxes
+    if len(truth) == 0 or boxes is None or len(boxes) == 0:
+        return 0, len(truth), 0 if boxes is None else len(boxes)
+    xyxy, cls, conf = boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy().astype(int), boxes.conf.cpu().numpy()
+    overlaps = box_iou(truth[:, 1:], xyxy) * (truth[:, None, 0].astype(int) == cls[None, :])
+    used, found = set(), 0
+    for ti in range(len(truth)):
+        for di in np.argsort(-overlaps[ti]):
+            if overlaps[ti, di] < iou_threshold:
+                break
+            if di not in used:
+                used.add(di)
+                found += 1
+                break
+    return found, len(truth), len(xyxy)
+
+
+def benchmark(model, dataset, configs, limit=200):
+    import cv2
+
+    image_paths = sorted(glob.glob(os.path.join(dataset, "images", "*")))[:limit]
+    samples = []
+    for path in image_paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            continue
+        label_path = os.path.join(dataset, "labels", os.path.splitext(os.path.basename(path))[0] + ".txt")
+        samples.append((frame, load_labels(label_path, frame.shape[1], frame.shape[0])))
+    if not samples:
+        raise ValueError(f"В {dataset}/images нет изображений")
+    model(samples[0][0], verbose=False)  # прогрев
+
+    report = []
+    for mode, tile, overlap in configs:
+        predictor = TiledPredictor(mode=mode, tile=tile, overlap=overlap) if mode != "off" else None
+        found = total = predicted = 0
+        started = time.perf_counter()
+        for frame, truth in samples:
+            result = predictor.predict(model, frame) if predictor else model(frame, verbose=False)[0]
+            f, t, p = match(truth, result)
+            found, total, predicted = found + f, total + t, predicted + p
+        latency = (time.perf_counter() - started) / len(samples) * 1000
+        row = {
+            "mode": mode,
+            "tile": tile,
+            "overlap": overlap,
+            "latency_ms": round(latency, 2),
+            "recall": round(found / total, 4) if total else 1.0,
+            "precision": round(found / predicted, 4) if predicted else 1.0,
+            "tiles_per_frame": round(predictor.stats["tiles"] / max(predictor.stats["frames"], 1), 1) if predictor else 0
+        }
+        report.append(row)
+        print(f"{mode:<6} tile={tile:<5} overlap={overlap:<4} {latency:8.1f} мс/кадр  recall {row['recall']:.3f}  "
+              f"precision {row['precision']:.3f}  плиток/кадр {row['tiles_per_frame']}")
+    return report
+
+
+if __name__ == "__main__":
+    import json
+
+    from inference import MODEL_FILES
+    from runtime import load_model
+
+    parser = argparse.ArgumentParser(description="Полнота и задержка плиточного инференса на размеченной выборке")
+    parser.add_argument("dataset", help="каталог с images/ и labels/ в формате YOLO")
+    parser.add_argument("--model", default="gunonly", choices=list(MODEL_FILES))
+    parser.add_argument("--tiles", default="640,960")
+    parser.add_argument("--overlap", type=float, default=0.2)
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    configs = [("off", 0, 0.0)]
+    for tile in [int(t) for t in args.tiles.split(",")]:
+        configs += [("full", tile, args.overlap), ("coarse", tile, args.overlap)]
+    model, _ = load_model(MODEL_FILES[args.model])
+    report = benchmark(model, args.dataset, configs, args.limit)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
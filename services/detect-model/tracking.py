@@ -0,0 +1,133 @@
+import itertools
+import time
+
+# Простой IoU-трекер на поток: объекты сохраняют id между кадрами, тревога поднимается
+# только для нового подтверждённого трека, при росте уверенности или по истечении realert_interval.
+# Гистерезис: трек подтверждается после min_hits кадров подряд и живёт ещё max_misses кадров без детекций.
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    def __init__(self, track_id, label, bbox, confidence):
+        self.id = track_id
+        self.label = label
+        self.bbox = bbox
+        self.confidence = confidence
+        self.hits = 1
+        self.misses = 0
+        self.alerted_confidence = None
+        self.last_alert = 0.0
+
+    def to_dict(self):
+        return {
+            "track_id": self.id,
+            "label": self.label,
+            "confidence": self.confidence,
+            "bbox": self.bbox,
+            "hits": self.hits
+        }
+
+
+class IouTracker:
+    def __init__(self, iou_threshold=0.3, min_hits=2, max_misses=15, escalation=0.05,
+                 realert_interval=60.0, immediate_confidence=1.01):
+        self.iou_threshold = iou_threshold
+        self.min_hits = min_hits
+        self.max_misses = max_misses
+        self.escalation = escalation
+        self.realert_interval = realert_interval
+        self.immediate_confidence = immediate_confidence
+        self.tracks = []
+        self.ids = itertools.count(1)
+        self.last_update = time.monotonic()
+
+    def _match(self, detections):
+        # Жадное сопоставление по убыванию IoU внутри одного класса
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            for di, (label, _, bbox) in enumerate(detections):
+                if label == track.label:
+                    overlap = iou(track.bbox, bbox)
+                    if overlap >= self.iou_threshold:
+                        pairs.append((overlap, ti, di))
+        pairs.sort(reverse=True)
+        matched_tracks, matched_detections, matches = set(), set(), []
+        for _, ti, di in pairs:
+            if ti not in matched_tracks and di not in matched_detections:
+                matched_tracks.add(ti)
+                matched_detections.add(di)
+                matches.append((ti, di))
+        return matches, matched_tracks, matched_detections
+
+    def update(self, detections):
+        # detections: список (label, confidence, [x1, y1, x2, y2]); возвращает треки, по которым нужна тревога.
+        # Отправленными треки отмечает mark_alerted, иначе неразосланный трек молчал бы до realert_interval
+        now = time.monotonic()
+        self.last_update = now
+        matches, matched_tracks, matched_detections = self._match(detections)
+
+        for ti, di in matches:
+            track = self.tracks[ti]
+            _, track.confidence, track.bbox = detections[di]
+            track.hits += 1
+            track.misses = 0
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.misses += 1
+                # Неподтверждённый трек должен набрать min_hits кадров подряд заново
+                if track.alerted_confidence is None:
+                    track.hits = 0
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        for di, (label, confidence, bbox) in enumerate(detections):
+            if di not in matched_detections:
+                self.tracks.append(Track(next(self.ids), label, bbox, confidence))
+
+        alerts = []
+        for track in self.tracks:
+            if track.misses:
+                continue
+            confirmed = track.hits >= self.min_hits or track.confidence >= self.immediate_confidence
+            if track.alerted_confidence is None:
+                if confirmed:
+                    alerts.append(track)
+            elif (track.confidence >= track.alerted_confidence + self.escalation
+                  or (self.realert_interval and now - track.last_alert >= self.realert_interval)):
+                alerts.append(track)
+        return alerts
+
+    def mark_alerted(self, tracks):
+        now = time.monotonic()
+        for track in tracks:
+            track.alerted_confidence = track.confidence
+            track.last_alert = now
+
+
+class TrackerRegistry:
+    # Отдельный трекер на каждый поток (клиент, камера); забытые потоки удаляются
+    def __init__(self, factory, idle_timeout=300.0):
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.trackers = {}
+
+    def get(self, stream_id):
+        tracker = self.trackers.get(stream_id)
+        if tracker is None:
+            self.prune()
+            tracker = self.trackers[stream_id] = self.factory()
+        return tracker
+
+    def prune(self):
+        now = time.monotonic()
+        for stream_id in [key for key, tracker in self.trackers.items()
+                          if now - tracker.last_update > self.idle_timeout]:
+            del self.trackers[stream_id]
+
+    def forget(self, stream_id):
+        self.trackers.pop(stream_id, None)
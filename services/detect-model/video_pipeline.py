@@ -0,0 +1,243 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import torch
+
+from inference import InferenceEngine
+from metrics import MEDIA_STAGE_SECONDS
+from motion import MotionGate
+
+# Видео режется на куски по кадрам, каждый кусок обрабатывает отдельный процесс.
+# Внутри процесса: поток декодирования -> инференс -> поток кодирования, между ними ограниченные очереди.
+# С шагом stride модели смотрят каждый N-й кадр, на пропущенных рисуются последние рамки.
+# Среди кадров с шагом stride статичные дополнительно отсеивает MotionGate.
+
+QUEUE_SIZE = 32
+_STOP = object()
+
+worker_engine = None
+
+
+def init_worker(batch_size, workers=1):
+    # Модели грузятся один раз на процесс; потоки torch делятся между процессами, иначе их cpu_count × workers
+    global worker_engine
+    cv2.setNumThreads(1)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    worker_engine = InferenceEngine.from_files(batch_size=batch_size)
+
+
+def warmup_worker(_):
+    # Модели грузятся лениво — прогреваем явно. Пауза раздаёт задачи разным процессам пула
+    worker_engine.models.warmup()
+    time.sleep(0.2)
+    return os.getpid()
+
+
+def video_info(video_path):
+    cap = cv2.VideoCapture(video_path)
+    info = (
+        int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        cap.get(cv2.CAP_PROP_FPS) or 25.0,
+        int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    )
+    cap.release()
+    return info
+
+
+def split_chunks(frame_count, chunks):
+    # CAP_PROP_FRAME_COUNT бывает заниженным (webm, часть муксеров): последний кусок читается до конца файла
+    size = max(1, -(-frame_count // chunks))
+    ranges = [(start, min(start + size, frame_count)) for start in range(0, frame_count, size)]
+    if ranges:
+        ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def _decode(video_path, start, end, frames, timings):
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    position = start
+    while end is None or position < end:
+        began = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            break
+        timings.append(("decode", time.perf_counter() - began))
+        frames.put(frame)
+        position += 1
+    cap.release()
+    frames.put(_STOP)
+
+
+def _encode(out_path, fps, size, processed, timings):
+    out = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    while True:
+        frame = processed.get()
+        if frame is _STOP:
+            break
+        began = time.perf_counter()
+        out.write(frame)
+        timings.append(("encode", time.perf_counter() - began))
+    out.release()
+
+
+def process_chunk(video_path, start, end, out_path, stride=1, engine=None, gate=None):
+    engine = engine or worker_engine
+    gate = gate or MotionGate.from_env()
+    _, fps, width, height = video_info(video_path)
+    frames = queue.Queue(maxsize=QUEUE_SIZE)
+    processed = queue.Queue(maxsize=QUEUE_SIZE)
+    # Длительности (этап, секунды) на кадр: кусок считается в процессе пула, метрики которого
+    # не отдаются — наблюдения переносит в гистограмму родитель
+    timings = []
+    decoder = threading.Thread(target=_decode, args=(video_path, start, end, frames, timings), daemon=True)
+    encoder = threading.Thread(target=_encode, args=(out_path, fps, (width, height), processed, timings),
+                               daemon=True)
+    started = time.perf_counter()
+    decoder.start()
+    encoder.start()
+
+    count = 0
+    inferred = 0
+    last_results = {}
+    batch = []
+
+    def flush():
+        nonlocal last_results, inferred
+        # Только кадры с шагом stride и заметными изменениями идут в модель, остальные получают рамки последнего кадра
+        selected = [index % stride == 0 and gate.needs_inference(out_path, frame) for index, frame in batch]
+        keyframes = [frame for (_, frame), is_key in zip(batch, selected) if is_key]
+        predictions = iter(engine.predict(keyframes)) if keyframes else iter(())
+        inferred += len(keyframes)
+        for (_, frame), is_key in zip(batch, selected):
+            if is_key:
+                last_results = next(predictions)
+                gate.update(out_path, last_results)
+            processed.put(engine.annotate(frame, last_results))
+        batch.clear()
+
+    while True:
+        frame = frames.get()
+        if frame is _STOP:
+            break
+        batch.append((count, frame))
+        count += 1
+        if len(batch) >= engine.batch_size * stride:
+            flush()
+    if batch:
+        flush()
+    processed.put(_STOP)
+    decoder.join()
+    encoder.join()
+    gate.forget(out_path)
+    return out_path, count, time.perf_counter() - started, inferred, timings
+
+
+def merge_chunks(chunk_paths, output_path, fps, size):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        # Склейка без перекодирования
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as listing:
+            for path in chunk_paths:
+                listing.write(f"file '{os.path.abspath(path)}'\n")
+        try:
+            subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                            "-i", listing.name, "-c", "copy", output_path], check=True)
+            return
+        except subprocess.CalledProcessError as e:
+            print(f"ffmpeg не склеил куски ({e}), склеиваем через OpenCV")
+        finally:
+            os.remove(listing.name)
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for path in chunk_paths:
+        cap = cv2.VideoCapture(path)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(frame)
+        cap.release()
+    out.release()
+
+
+_pool = None
+
+
+def get_pool(workers, batch_size):
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(batch_size, workers)
+        )
+    return _pool
+
+
+def process_video_parallel(video_path, output_path, workers=4, stride=1, batch_size=8, chunks=None, progress=None):
+    frame_count, fps, width, height = video_info(video_path)
+    ranges = split_chunks(frame_count, chunks or workers)
+    pool = get_pool(workers, batch_size)
+    chunk_dir = tempfile.mkdtemp(prefix="chunks_")
+    started = time.perf_counter()
+    try:
+        futures = [
+            pool.submit(process_chunk, video_path, start, end, os.path.join(chunk_dir, f"{index:04d}.mp4"), stride)
+            for index, (start, end) in enumerate(ranges)
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if progress:
+                progress(done / (len(futures) + 1))
+        results = [future.result() for future in futures]
+        merge_chunks([path for path, _, _, _, _ in results], output_path, fps, (width, height))
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+    elapsed = time.perf_counter() - started
+    for _, _, _, _, timings in results:
+        for stage, seconds in timings:
+            MEDIA_STAGE_SECONDS.labels(stage).observe(seconds)
+    frames = sum(count for _, count, _, _, _ in results)
+    inferred = sum(chunk_inferred for _, _, _, chunk_inferred, _ in results)
+    return frames, elapsed, inferred
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение последовательной и параллельной обработки видео")
+    parser.add_argument("video")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--stride", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    output_dir = tempfile.mkdtemp(prefix="video_bench_")
+    serial_engine = InferenceEngine.from_files(batch_size=1)
+    _, frames, elapsed, _, _ = process_chunk(args.video, 0, None,
+                                             os.path.join(output_dir, "serial.mp4"), engine=serial_engine,
+                                             gate=MotionGate(enabled=False))
+    print(f"Последовательно:  {frames} кадров за {elapsed:.1f} с, {frames / elapsed:.2f} кадр/с")
+
+    # Прогрев: модели во всех процессах загружаются до замера
+    pool, warmed = get_pool(args.workers, args.batch_size), set()
+    for _ in range(5):
+        warmed.update(pool.map(warmup_worker, range(args.workers)))
+        if len(warmed) >= args.workers:
+            break
+    frames, elapsed, inferred = process_video_parallel(args.video, os.path.join(output_dir, "parallel.mp4"),
+                                                       workers=args.workers, stride=args.stride,
+                                                       batch_size=args.batch_size)
+    print(f"Параллельно ({args.workers} процессов, stride={args.stride}): "
+          f"{frames} кадров за {elapsed:.1f} с, {frames / elapsed:.2f} кадр/с, "
+          f"через модели прошло {inferred} ({inferred / max(frames, 1):.0%})")
+    shutil.rmtree(output_dir, ignore_errors=True)
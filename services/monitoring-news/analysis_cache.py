@@ -0,0 +1,212 @@
+import hashlib
+import re
+from datetime import timedelta
+
+# Кэш результатов анализа Gemini по хешу нормализованного текста.
+# Репосты с небольшими правками находятся через SimHash: 64 бита режутся на 4 полосы по 16 бит,
+# при расстоянии Хэмминга <= 3 хотя бы одна полоса совпадает точно (принцип Дирихле).
+# Узкие полосы дают сотни случайных кандидатов на каждый промах уже на 100 тыс. записей.
+
+URL_RE = re.compile(r"https?://\S+|t\.me/\S+|www\.\S+")
+MENTION_RE = re.compile(r"[@#]\w+")
+WORD_RE = re.compile(r"[a-zа-яәғқңөұүһі0-9]+")
+
+SIMHASH_BITS = 64
+BANDS = 4
+CANDIDATE_LIMIT = 50
+BAND_WIDTHS = [SIMHASH_BITS // BANDS + (1 if i < SIMHASH_BITS % BANDS else 0) for i in range(BANDS)]
+BAND_COLUMNS = [f"band{i}" for i in range(BANDS)]
+
+
+def normalize_text(text):
+    text = (text or "").lower().replace("ё", "е")
+    text = URL_RE.sub(" ", text)
+    text = MENTION_RE.sub(" ", text)
+    return " ".join(WORD_RE.findall(text))
+
+
+def text_hash(normalized):
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(normalized):
+    # Признаки — отдельные слова: у коротких постов шинглы слишком чувствительны к правкам
+    vector = [0] * SIMHASH_BITS
+    for word in normalized.split() or [""]:
+        h = _hash64(word)
+        for bit in range(SIMHASH_BITS):
+            vector[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if vector[bit] > 0)
+
+
+def bands(value):
+    result = []
+    for width in BAND_WIDTHS:
+        result.append(value & ((1 << width) - 1))
+        value >>= width
+    return result
+
+
+def to_signed(value):
+    # BIGINT в Postgres знаковый
+    return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << SIMHASH_BITS) if value < 0 else value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class AnalysisCache:
+    def __init__(self, acquire, ttl_hours=72, max_entries=100000, max_distance=3, enabled=True):
+        self.acquire = acquire
+        self.ttl = timedelta(hours=ttl_hours)
+        self.max_entries = max_entries
+        self.max_distance = min(max_distance, BANDS - 1)
+        self.enabled = enabled
+        self.stats = {
+            "lookups": 0,
+            "exact_hits": 0,
+            "near_hits": 0,
+            "stores": 0,
+            "evicted": 0
+        }
+
+    async def init_table(self, conn):
+        # Таблица со старой раскладкой полос (band0..band5) — это только кэш, пересоздаём
+        stale = await conn.fetchval("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_name = 'analysis_cache' AND column_name LIKE 'band%'
+        """)
+        if stale and stale != BANDS:
+            await conn.execute("DROP TABLE analysis_cache")
+        band_columns = "".join(f"{column} INTEGER NOT NULL,\n                " for column in BAND_COLUMNS)
+        band_indexes = "\n            ".join(
+            f"CREATE INDEX IF NOT EXISTS analysis_cache_{column}_idx ON analysis_cache ({column});"
+            for column in BAND_COLUMNS
+        )
+        await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                text_hash TEXT PRIMARY KEY,
+                simhash BIGINT NOT NULL,
+                {band_columns}is_emergency BOOLEAN NOT NULL,
+                location TEXT NULL,
+                problem TEXT NULL,
+                solution TEXT NULL,
+                solution_user TEXT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT NOW(),
+                last_hit_at TIMESTAMP DEFAULT NOW()
+            );
+
+            {band_indexes}
+            CREATE INDEX IF NOT EXISTS analysis_cache_last_hit_idx ON analysis_cache (last_hit_at);
+        """)
+
+    @staticmethod
+    def _result(row):
+        return row['is_emergency'], row['location'], row['problem'], row['solution'], row['solution_user']
+
+    async def get(self, text):
+        if not self.enabled:
+            return None
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        self.stats["lookups"] += 1
+        key = text_hash(normalized)
+        fingerprint = simhash(normalized)
+
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT text_hash, is_emergency, location, problem, solution, solution_user
+                FROM analysis_cache
+                WHERE text_hash = $1 AND created_at > NOW() - $2::interval
+            """, key, self.ttl)
+            if row:
+                self.stats["exact_hits"] += 1
+            elif self.max_distance > 0:
+                # Ближайшие по Хэммингу первыми, чтобы LIMIT не отрезал настоящий дубль
+                band_filter = " OR ".join(f"{column} = ${i + 3}" for i, column in enumerate(BAND_COLUMNS))
+                candidates = await conn.fetch(f"""
+                    SELECT text_hash, simhash, is_emergency, location, problem, solution, solution_user
+                    FROM analysis_cache
+                    WHERE ({band_filter})
+                      AND created_at > NOW() - $1::interval
+                    ORDER BY length(replace(((simhash # $2)::bit(64))::text, '0', ''))
+                    LIMIT {CANDIDATE_LIMIT}
+                """, self.ttl, to_signed(fingerprint), *bands(fingerprint))
+                best = None
+                for candidate in candidates:
+                    distance = hamming(fingerprint, to_unsigned(candidate['simhash']))
+                    if distance <= self.max_distance and (best is None or distance < best[0]):
+                        best = (distance, candidate)
+                if best:
+                    row = best[1]
+                    self.stats["near_hits"] += 1
+            if not row:
+                return None
+            await conn.execute("""
+                UPDATE analysis_cache SET hits = hits + 1, last_hit_at = NOW() WHERE text_hash = $1
+            """, row['text_hash'])
+        return self._result(row)
+
+    async def put(self, text, result):
+        if not self.enabled:
+            return
+        normalized = normalize_text(text)
+        if not normalized:
+            return
+        fingerprint = simhash(normalized)
+        is_emergency, location, problem, solution, solution_user = result
+        columns = ["text_hash", "simhash", *BAND_COLUMNS,
+                   "is_emergency", "location", "problem", "solution", "solution_user"]
+        placeholders = ", ".join(f"${i + 1}" for i in range(len(columns)))
+        async with self.acquire() as conn:
+            await conn.execute(f"""
+                INSERT INTO analysis_cache ({", ".join(columns)})
+                VALUES ({placeholders})
+                ON CONFLICT (text_hash) DO UPDATE SET
+                    is_emergency = EXCLUDED.is_emergency,
+                    location = EXCLUDED.location,
+                    problem = EXCLUDED.problem,
+                    solution = EXCLUDED.solution,
+                    solution_user = EXCLUDED.solution_user,
+                    created_at = NOW(),
+                    last_hit_at = NOW()
+            """, text_hash(normalized), to_signed(fingerprint), *bands(fingerprint),
+                is_emergency, location, problem, solution, solution_user)
+        self.stats["stores"] += 1
+
+    async def evict(self):
+        # Сначала по TTL, затем самые давно не использованные сверх лимита
+        if not self.enabled:
+            return
+        async with self.acquire() as conn:
+            expired = await conn.execute("""
+                DELETE FROM analysis_cache WHERE created_at <= NOW() - $1::interval
+            """, self.ttl)
+            overflow = await conn.execute("""
+                DELETE FROM analysis_cache WHERE text_hash IN (
+                    SELECT text_hash FROM analysis_cache
+                    ORDER BY last_hit_at DESC
+                    OFFSET $1
+                )
+            """, self.max_entries)
+        self.stats["evicted"] += int(expired.split()[-1]) + int(overflow.split()[-1])
+
+    def hit_rate(self):
+        lookups = self.stats["lookups"]
+        return (self.stats["exact_hits"] + self.stats["near_hits"]) / lookups if lookups else 0.0
+
+    def print_stats(self):
+        print(f"Кэш анализа: запросов {self.stats['lookups']}, точных попаданий {self.stats['exact_hits']}, "
+              f"похожих {self.stats['near_hits']}, hit rate {self.hit_rate():.1%}, "
+              f"сохранено {self.stats['stores']}, вытеснено {self.stats['evicted']}")
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import asyncpg
+from aiohttp import web
+
+# Офлайн-замер конвейера новостей: save_news_batch (сохранение с анализом) и analyze_with_gemini
+# против локальной заглушки Gemini (задержка настраивается) и одноразовой базы Postgres,
+# которая создаётся на время прогона и удаляется после. Результат — JSON для сравнения запусков.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ("analyze", "save")
+
+EMERGENCY_TEXTS = [
+    "Пожар на складе в Алматы, на месте работают пожарные расчёты, есть пострадавшие",
+    "ДТП с участием автобуса на трассе Алматы — Капшагай, госпитализированы пассажиры",
+    "Наводнение в Жетысуской области: эвакуированы жители нескольких сёл",
+    "Взрыв газа в жилом доме в Шымкенте, спасатели разбирают завалы"
+]
+NEUTRAL_TEXTS = [
+    "В Астане открылась выставка современного искусства, вход свободный",
+    "Курс тенге на бирже укрепился по итогам торгов",
+    "Футбольный клуб Кайрат подписал нового полузащитника",
+    "В городе прошёл фестиваль уличной еды и музыки"
+]
+
+
+def percentiles(values):
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000
+
+    return {
+        "p50": round(pick(0.50), 2),
+        "p95": round(pick(0.95), 2),
+        "p99": round(pick(0.99), 2),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 2)
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=SCRIPT_DIR).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def make_messages(count, emergency_ratio, run_id, seed=0):
+    # Уникальный номер в каждом тексте: без --cache кэш анализа выключен, с ним — проверяются почти-дубли
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        texts = EMERGENCY_TEXTS if rng.random() < emergency_ratio else NEUTRAL_TEXTS
+        messages.append({
+            "news_link": f"https://t.me/bench_{run_id}/{i}",
+            "body": f"{rng.choice(texts)}. Сообщение №{i}.",
+            "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "posted_at": time.time()
+        })
+    return messages
+
+
+class GeminiStub:
+    # Заглушка generateContent и /emergency/batch бэкенда
+    def __init__(self, latency_ms, jitter_ms, seed=0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.emergencies = 0
+
+    async def generate(self, request):
+        self.calls += 1
+        body = await request.json()
+        prompt = body["contents"][0]["parts"][0]["text"]
+        await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        is_emergency = any(text.split()[0] in prompt for text in EMERGENCY_TEXTS)
+        if "generationConfig" in body:
+            text = json.dumps({
+                "is_emergency": is_emergency,
+                "location": "Алматы" if is_emergency else "",
+                "problem": "Тестовое ЧП" if is_emergency else "",
+                "solution": "Работают экстренные службы" if is_emergency else "",
+                "solution_user": "Соблюдайте осторожность" if is_emergency else ""
+            }, ensure_ascii=False)
+        elif 'Ответь только "Да" или "Нет"' in prompt:
+            text = "Да" if is_emergency else "Нет"
+        elif "Формат ответа" in prompt:
+            text = "Проблема: Тестовое ЧП\nРешение: Работают экстренные службы"
+        else:
+            text = "Алматы"
+        return web.json_response({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+    async def emergency_batch(self, request):
+        body = await request.json()
+        self.emergencies += len(body["emergencies"])
+        return web.json_response({"accepted": len(body["emergencies"]), "rejected": []})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1beta/models/{model}", self.generate)
+        app.router.add_post("/emergency/batch", self.emergency_batch)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+async def run_clients(concurrency, items, call):
+    latencies = []
+    queue = iter(items)
+
+    async def client():
+        for item in queue:
+            begin = time.perf_counter()
+            await call(item)
+            latencies.append(time.perf_counter() - begin)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+async def run(args):
+    stub = GeminiStub(args.gemini_latency_ms, args.gemini_jitter_ms)
+    stub_url = await stub.start()
+
+    # parser.py читает config.json из текущего каталога при импорте — подкладываем свой во временный каталог
+    work_dir = tempfile.mkdtemp(prefix="news_bench_")
+    with open(os.path.join(work_dir, "config.json"), "w") as f:
+        json.dump({
+            "gemini_api_key": "bench",
+            "gemini_mode": args.gemini_mode,
+            "accounts": [],
+            "prefilter": {"enabled": not args.no_prefilter,
+                          "model_path": os.path.join(SCRIPT_DIR, "prefilter_model.json")},
+            "analysis_cache": {"enabled": args.cache},
+            "scheduler": {"gemini_concurrency": args.gemini_concurrency},
+            "backend": {"url": stub_url, "outbox_path": os.path.join(work_dir, "outbox.db")}
+        }, f)
+    os.chdir(work_dir)
+    sys.path.insert(0, SCRIPT_DIR)
+    import parser as news
+
+    news.GEMINI_URL = f"{stub_url}/v1beta/models/gemini-bench:generateContent"
+
+    # Одноразовая база на том же сервере Postgres
+    database = f"news_bench_{uuid.uuid4().hex[:8]}"
+    server = {key: news.db_config[key] for key in ("user", "password", "host", "port")}
+    if args.pg_host:
+        server["host"] = args.pg_host
+    admin = await asyncpg.connect(database="postgres", **server)
+    await admin.execute(f'CREATE DATABASE "{database}"')
+    news.db_config.update(server, database=database)
+
+    results = []
+    delivery_task = None
+    try:
+        await news.init_pool()
+        await news.init_db()
+        await news.delivery.init()
+        delivery_task = asyncio.create_task(news.delivery.run())
+        source_id = await news.get_or_create_source("https://t.me/bench", "bench")
+
+        for scenario in args.scenario or SCENARIOS:
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                run_id = uuid.uuid4().hex[:8]
+                messages = make_messages(args.messages, args.emergency_ratio, run_id)
+                calls_before = stub.calls
+                if scenario == "analyze":
+                    latencies, elapsed = await run_clients(
+                        concurrency, messages, lambda message: news.analyze_with_gemini(message["body"]))
+                else:
+                    latencies, elapsed = await run_clients(
+                        concurrency, messages, lambda message: news.save_news_batch(source_id, [message]))
+                results.append({
+                    "scenario": scenario,
+                    "concurrency": concurrency,
+                    "messages": len(latencies),
+                    "latency_ms": percentiles(latencies),
+                    "throughput_per_s": round(len(latencies) / elapsed, 3),
+                    "gemini_calls": stub.calls - calls_before,
+                    "peak_rss_mb": peak_rss_mb()
+                })
+                print(f"{scenario:<8} c={concurrency:<3} p50 {results[-1]['latency_ms']['p50']:8.1f} мс  "
+                      f"p95 {results[-1]['latency_ms']['p95']:8.1f} мс  p99 {results[-1]['latency_ms']['p99']:8.1f} мс  "
+                      f"{results[-1]['throughput_per_s']:7.1f} сообщ/с  Gemini {results[-1]['gemini_calls']}",
+                      file=sys.stderr)
+    finally:
+        if delivery_task is not None:
+            delivery_task.cancel()
+        await news.close_http_session()
+        await news.close_pool()
+        await admin.execute(f'DROP DATABASE IF EXISTS "{database}"')
+        await admin.close()
+        await stub.stop()
+        os.chdir(SCRIPT_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results, stub.emergencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера новостей, результат в JSON")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="можно указать несколько раз; по умолчанию все")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--emergency-ratio", type=float, default=0.2)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=100)
+    parser.add_argument("--gemini-mode", choices=("structured", "sequential"), default="structured")
+    parser.add_argument("--gemini-concurrency", type=int, default=8)
+    parser.add_argument("--no-prefilter", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="включить кэш анализа")
+    parser.add_argument("--pg-host", help="сервер Postgres для одноразовой базы (по умолчанию из parser.py)")
+    parser.add_argument("--output", default="-", help="файл для JSON, - — stdout")
+    args = parser.parse_args()
+
+    results, delivered = asyncio.run(run(args))
+    report = {
+        "suite": "monitoring-news",
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key != "output"},
+        "emergencies_delivered": delivered,
+        "results": results
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
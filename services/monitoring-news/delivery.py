@@ -0,0 +1,261 @@
+import asyncio
+import json
+import random
+import sqlite3
+import time
+
+from telemetry import DELIVERED, DELIVERY_LATENCY, DELIVERY_SECONDS, ERRORS, QUEUE_DEPTH, linked_span, timed
+
+# Доставка ЧП в TypeScript-бэкенд: сначала запись в outbox на диске, затем пачками на /emergency/batch.
+# Пока бэкенд недоступен, записи копятся в outbox и переживают перезапуск процесса.
+
+
+class PostError(RuntimeError):
+    def __init__(self, status):
+        super().__init__(f"статус {status}")
+        self.status = status
+
+    @property
+    def permanent(self):
+        # 4xx (кроме таймаута и лимита запросов) повтор той же пачки не исправит
+        return 400 <= self.status < 500 and self.status not in (408, 429)
+
+
+class EmergencyDelivery:
+    def __init__(self, get_session, batch_url, outbox_path="emergency_outbox.db", batch_window=0.5,
+                 max_batch=50, max_batch_bytes=512 * 1024, max_attempts=20, base_backoff=1.0,
+                 max_backoff=300.0, lock_timeout=60):
+        self.get_session = get_session
+        self.batch_url = batch_url
+        self.outbox_path = outbox_path
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_batch_bytes = max_batch_bytes
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lock_timeout = lock_timeout
+        self.wakeup = asyncio.Event()
+        self.failures = 0
+        self.stats = {
+            "enqueued": 0,
+            "delivered": 0,
+            "rejected": 0,
+            "failed_posts": 0,
+            "dead": 0
+        }
+        self.outbox_latencies = []
+        self.end_to_end_latencies = []
+
+    def _run(self, statements):
+        conn = sqlite3.connect(self.outbox_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            result = statements(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    async def init(self):
+        def create(conn):
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    posted_at REAL NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    locked_until REAL NULL
+                )
+            """)
+            # Контекст трассировки для выборочных трасс; колонка добавляется и в старые outbox
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            if "trace" not in columns:
+                conn.execute("ALTER TABLE outbox ADD COLUMN trace TEXT NULL")
+            # Записи, которые бэкенд так и не принял; вернуть в outbox можно вручную
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox_dead (
+                    id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    posted_at REAL NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT NULL,
+                    failed_at REAL NOT NULL
+                )
+            """)
+        await asyncio.to_thread(self._run, create)
+
+    async def enqueue(self, data, posted_at=None, trace=None):
+        body = json.dumps(data, ensure_ascii=False, default=str)
+        trace = json.dumps(trace) if trace else None
+        await asyncio.to_thread(self._run, lambda conn: conn.execute(
+            "INSERT INTO outbox (payload, enqueued_at, posted_at, trace) VALUES (?, ?, ?, ?)",
+            (body, time.time(), posted_at, trace)
+        ))
+        self.stats["enqueued"] += 1
+        self.wakeup.set()
+
+    def _claim(self):
+        now = time.time()
+
+        def claim(conn):
+            rows = conn.execute("""
+                SELECT id, payload, enqueued_at, posted_at, trace, attempts FROM outbox
+                WHERE locked_until IS NULL OR locked_until < ?
+                ORDER BY id LIMIT ?
+            """, (now, self.max_batch)).fetchall()
+            # Пачка ограничена и по размеру тела, но хотя бы одна запись берётся всегда
+            size = 0
+            for count, row in enumerate(rows):
+                size += len(row[1].encode("utf-8"))
+                if count and size > self.max_batch_bytes:
+                    rows = rows[:count]
+                    break
+            if rows:
+                conn.executemany(
+                    "UPDATE outbox SET locked_until = ? WHERE id = ?",
+                    [(now + self.lock_timeout, row[0]) for row in rows]
+                )
+            return rows
+        return self._run(claim)
+
+    def _delete(self, ids):
+        self._run(lambda conn: conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids]))
+
+    def _release(self, ids, failed=False):
+        # failed — бэкенд ответил ошибкой; сетевые сбои попыткой не считаются, outbox переживает простой бэкенда
+        self._run(lambda conn: conn.executemany(
+            "UPDATE outbox SET locked_until = NULL, attempts = attempts + ? WHERE id = ?",
+            [(int(failed), i) for i in ids]
+        ))
+
+    def _count_attempt(self, ids):
+        self._run(lambda conn: conn.executemany(
+            "UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in ids]
+        ))
+
+    def _bury(self, rows, error):
+        def bury(conn):
+            conn.executemany("""
+                INSERT OR REPLACE INTO outbox_dead (id, payload, enqueued_at, posted_at, attempts, last_error, failed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(row[0], row[1], row[2], row[3], row[5] + 1, error, time.time()) for row in rows])
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in rows])
+        self._run(bury)
+
+    async def _post(self, payloads, traces=()):
+        session = await self.get_session()
+        with linked_span("emergency.post", traces, count=len(payloads)), timed(DELIVERY_SECONDS):
+            async with session.post(self.batch_url, json={"emergencies": payloads}) as response:
+                if response.status != 200:
+                    raise PostError(response.status)
+                result = await response.json()
+        return result.get("rejected", [])
+
+    async def deliver_once(self):
+        rows = await asyncio.to_thread(self._claim)
+        if not rows:
+            return 0
+        return await self._deliver(rows)
+
+    async def _deliver(self, rows):
+        ids = [row[0] for row in rows]
+        try:
+            rejected = await self._post([json.loads(row[1]) for row in rows],
+                                        [json.loads(row[4]) for row in rows if row[4]])
+        except Exception as e:
+            self.stats["failed_posts"] += 1
+            ERRORS.labels("delivery").inc()
+            # Пачку, которую бэкенд не примет (413, 400) или которая исчерпала попытки, делим пополам,
+            # пока виноватая запись не останется одна; её — в outbox_dead, чтобы не держать очередь
+            hopeless = isinstance(e, PostError) and (
+                e.permanent or min(row[5] for row in rows) + 1 >= self.max_attempts)
+            if hopeless and len(rows) > 1:
+                print(f"Бэкенд не принял пачку из {len(rows)} ЧП: {e}. Делим пополам")
+                await asyncio.to_thread(self._count_attempt, ids)
+                rows = [row[:5] + (row[5] + 1,) for row in rows]
+                half = len(rows) // 2
+                return await self._deliver(rows[:half]) + await self._deliver(rows[half:])
+            if hopeless:
+                await asyncio.to_thread(self._bury, rows, str(e))
+                self.stats["dead"] += len(rows)
+                DELIVERED.labels("dead").inc(len(rows))
+                print(f"ЧП {rows[0][0]} перенесено в outbox_dead после {rows[0][5] + 1} попыток: {e}")
+                return len(rows)
+            self.failures += 1
+            await asyncio.to_thread(self._release, ids, isinstance(e, PostError))
+            # Экспоненциальная задержка с полным джиттером
+            delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** self.failures))
+            print(f"Ошибка отправки {len(rows)} ЧП в TypeScript-бэкенд: {e}. Повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+            return 0
+
+        self.failures = 0
+        await asyncio.to_thread(self._delete, ids)
+        now = time.time()
+        for index, (_, _, enqueued_at, posted_at, _, _) in enumerate(rows):
+            if index in rejected:
+                continue
+            self.outbox_latencies.append(now - enqueued_at)
+            if posted_at:
+                self.end_to_end_latencies.append(now - posted_at)
+                DELIVERY_LATENCY.observe(now - posted_at)
+        DELIVERED.labels("delivered").inc(len(rows) - len(rejected))
+        DELIVERED.labels("rejected").inc(len(rejected))
+        if rejected:
+            self.stats["rejected"] += len(rejected)
+            print(f"Бэкенд отклонил {len(rejected)} ЧП как некорректные")
+        self.stats["delivered"] += len(rows) - len(rejected)
+        print(f"Данные ЧП успешно отправлены в TypeScript-бэкенд: {len(rows) - len(rejected)} шт.")
+        return len(rows)
+
+    async def run(self):
+        while True:
+            try:
+                sent = await self.deliver_once()
+            except Exception as e:
+                print(f"Ошибка доставки ЧП: {e}")
+                sent = 0
+            # Полная пачка или повтор после ошибки (задержка уже выдержана) — сразу следующая попытка
+            if sent >= self.max_batch or self.failures:
+                continue
+            # Ждём новых записей, затем короткое окно, чтобы собрать пачку
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.lock_timeout)
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(self.batch_window)
+
+    async def depth(self):
+        return await asyncio.to_thread(
+            self._run, lambda conn: conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        )
+
+    @staticmethod
+    def _percentiles(values):
+        ordered = sorted(values)
+        p50 = ordered[len(ordered) // 2]
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return p50, p95, ordered[-1]
+
+    async def print_stats(self):
+        depth = await self.depth()
+        QUEUE_DEPTH.labels("outbox").set(depth)
+        print(f"Доставка ЧП: в outbox {depth}, поставлено {self.stats['enqueued']}, "
+              f"доставлено {self.stats['delivered']}, отклонено {self.stats['rejected']}, "
+              f"неудачных POST {self.stats['failed_posts']}, в outbox_dead {self.stats['dead']}")
+        if self.outbox_latencies:
+            p50, p95, worst = self._percentiles(self.outbox_latencies)
+            print(f"Задержка outbox → бэкенд: p50 {p50:.2f} с, p95 {p95:.2f} с, максимум {worst:.2f} с")
+            self.outbox_latencies.clear()
+        if self.end_to_end_latencies:
+            p50, p95, worst = self._percentiles(self.end_to_end_latencies)
+            print(f"Задержка пост → бэкенд: p50 {p50:.1f} с, p95 {p95:.1f} с, максимум {worst:.1f} с")
+            self.end_to_end_latencies.clear()
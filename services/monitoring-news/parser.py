@@ -1,23 +1,59 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
 import asyncpg
 from telethon.tl.functions.channels import JoinChannelRequest, LeaveChannelRequest
 from telethon.tl.functions.messages import ImportChatInviteRequest
 from telethon.tl.functions.messages import DeleteChatUserRequest
 from telethon.tl.types import InputPeerChannel, InputPeerChat
 import json
-from telethon import TelegramClient, errors
+from telethon import TelegramClient, errors, events, utils
 import datetime as dt
 from datetime import datetime, timedelta
 import pytz
 import aiohttp
+from prefilter import Prefilter
+from analysis_cache import AnalysisCache
+from work_queue import create_queue
+from delivery import EmergencyDelivery
+from telemetry import (ANALYSIS, DB_SECONDS, ERRORS, FETCH_SECONDS, GEMINI_SECONDS, MESSAGES, QUEUE_DEPTH,
+                       continue_span, inject, root_span, setup_tracing, span, start_exporter, timed)
+import sys
+import zlib
 
 with open('config.json') as f:
     config = json.load(f)
 
 GEMINI_API_KEY = config["gemini_api_key"]
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent"
+# "structured" — один запрос с JSON-схемой, "sequential" — старые четыре запроса
+GEMINI_MODE = config.get("gemini_mode", "structured")
+http_config = config.get("http", {})
+
+prefilter_config = config.get("prefilter", {})
+PREFILTER_THRESHOLD = prefilter_config.get("threshold", 0.5)
+prefilter = Prefilter.load(prefilter_config.get("model_path", "prefilter_model.json"))
+PREFILTER_ENABLED = prefilter_config.get("enabled", True) and prefilter.trained
+if prefilter_config.get("enabled", True) and not prefilter.trained:
+    print("Модель префильтра не найдена, префильтр выключен: все сообщения уходят в Gemini")
+prefilter_stats = {"checked": 0, "passed": 0}
 
 accounts = config["accounts"]
-utc = pytz.timezone("Asia/Almaty")
-time_limit = utc.localize(datetime.now() - timedelta(hours=3) - timedelta(minutes=30)).strftime('%Y-%m-%d %H:%M:%S')
+local_tz = pytz.timezone("Asia/Almaty")
+# Окно по времени нужно только при холодном старте канала, дальше читаем от курсора
+COLD_START_WINDOW = timedelta(minutes=config.get("cold_start_window_minutes", 210))
+
+# "poll" — опрос каналов раз в минуту, "realtime" — постоянное подключение и events.NewMessage
+INGEST_MODE = config.get("ingest_mode", "poll")
+realtime_config = config.get("realtime", {})
+RECONNECT_DELAY = realtime_config.get("reconnect_delay", 10)
+CHANNEL_REFRESH_INTERVAL = realtime_config.get("channel_refresh_interval", 300)
+STATS_INTERVAL = realtime_config.get("stats_interval", 60)
+
+telemetry_config = config.get("telemetry", {})
+
+backend_config = config.get("backend", {})
+BACKEND_URL = backend_config.get("url", "http://192.168.0.163:4004")
 
 db_config = {
     "user": "postgres",
@@ -27,18 +63,106 @@ db_config = {
     "port": 5432
 }
 
+pool_config = config.get("db_pool", {})
+NEWS_BATCH_SIZE = config.get("news_batch_size", 100)
+
+scheduler_config = config.get("scheduler", {})
+CHANNELS_PER_ACCOUNT = scheduler_config.get("channels_per_account", 5)
+ANALYSIS_WORKERS = scheduler_config.get("analysis_workers", 4)
+QUEUE_SIZE = scheduler_config.get("queue_size", 50)
+queue_config = config.get("queue", {})
+# all — чтение и анализ в одном процессе, ingest — только чтение Telegram, worker — только анализ
+ROLE = sys.argv[1] if len(sys.argv) > 1 else config.get("role", "all")
+GEMINI_CONCURRENCY = scheduler_config.get("gemini_concurrency", 8)
+FLOOD_WAIT_RETRIES = scheduler_config.get("flood_wait_retries", 3)
+
+db_pool = None
+pool_stats = {
+    "acquisitions": 0,
+    "wait_time": 0.0,
+    "max_wait": 0.0
+}
+
+async def init_pool():
+    global db_pool
+    if db_pool is None:
+        db_pool = await asyncpg.create_pool(
+            **db_config,
+            min_size=pool_config.get("min_size", 2),
+            max_size=pool_config.get("max_size", 10),
+            statement_cache_size=pool_config.get("statement_cache_size", 100),
+            max_inactive_connection_lifetime=pool_config.get("max_inactive_connection_lifetime", 300),
+            timeout=30
+        )
+    return db_pool
+
+async def close_pool():
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
+
+@asynccontextmanager
+async def acquire():
+    # Одно соединение из общего пула + учёт времени ожидания
+    pool = await init_pool()
+    started = time.perf_counter()
+    async with pool.acquire(timeout=pool_config.get("acquire_timeout", 30)) as conn:
+        waited = time.perf_counter() - started
+        pool_stats["acquisitions"] += 1
+        pool_stats["wait_time"] += waited
+        pool_stats["max_wait"] = max(pool_stats["max_wait"], waited)
+        DB_SECONDS.labels("wait").observe(waited)
+        with timed(DB_SECONDS.labels("query")):
+            yield conn
+
+http_session = None
+
+async def get_http_session():
+    # Одна сессия на весь процесс: keep-alive и общий пул TCP-соединений
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=http_config.get("pool_limit", 20),
+                ttl_dns_cache=http_config.get("dns_cache_ttl", 300)
+            ),
+            timeout=aiohttp.ClientTimeout(total=http_config.get("timeout", 60))
+        )
+    return http_session
+
+async def close_http_session():
+    global http_session
+    if http_session is not None:
+        await http_session.close()
+        http_session = None
+
+cache_config = config.get("analysis_cache", {})
+analysis_cache = AnalysisCache(
+    acquire,
+    ttl_hours=cache_config.get("ttl_hours", 72),
+    max_entries=cache_config.get("max_entries", 100000),
+    max_distance=cache_config.get("max_distance", 3),
+    enabled=cache_config.get("enabled", True)
+)
+
+def print_pool_stats():
+    acquisitions = pool_stats["acquisitions"]
+    avg_wait = pool_stats["wait_time"] / acquisitions if acquisitions else 0.0
+    size = db_pool.get_size() if db_pool else 0
+    idle = db_pool.get_idle_size() if db_pool else 0
+    print(f"Пул БД: соединений {size} (свободно {idle}), выдач {acquisitions}, "
+          f"среднее ожидание {avg_wait * 1000:.1f} мс, максимум {pool_stats['max_wait'] * 1000:.1f} мс")
+
 async def get_channels():
     retries = 3
     for attempt in range(retries):
         try:
-            conn = await asyncpg.connect(**db_config, timeout=30)
-            try:
+            async with acquire() as conn:
                 sources = await conn.fetch("""
                     SELECT link FROM sources WHERE type = 'telegram'
                 """)
                 return [source['link'] for source in sources]
-            finally:
-                await conn.close()
         except (asyncpg.exceptions.TimeoutError, TimeoutError) as e:
             print(f"Попытка {attempt + 1}/{retries} не удалась: {e}")
             if attempt < retries - 1:
@@ -47,8 +171,8 @@ async def get_channels():
                 print("Не удалось подключиться к базе данных после всех попыток.")
                 return []
 
-async def analyze_with_gemini(text):
-    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent"
+async def analyze_with_gemini_sequential(text):
+    url = GEMINI_URL
     headers = {
         "Content-Type": "application/json",
         "x-goog-api-key": GEMINI_API_KEY
@@ -63,166 +187,375 @@ async def analyze_with_gemini(text):
         "contents": [{"parts": [{"text": classification_prompt}]}]
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=classification_data) as response:
-            if response.status == 200:
-                result = await response.json()
-                classification_text = result["candidates"][0]["content"]["parts"][0]["text"].strip()
-                is_emergency = classification_text.lower() == "да"
-            else:
-                print(f"Ошибка классификации текста: {response.status}")
-                is_emergency = False
+    session = await get_http_session()
+    async with session.post(url, headers=headers, json=classification_data) as response:
+        if response.status == 200:
+            result = await response.json()
+            classification_text = result["candidates"][0]["content"]["parts"][0]["text"].strip()
+            is_emergency = classification_text.lower() == "да"
+        else:
+            print(f"Ошибка классификации текста: {response.status}")
+            return None
 
-        if not is_emergency:
-            return is_emergency, "Неизвестно", "Не применимо", "Не применимо", "Не применимо"
+    if not is_emergency:
+        return is_emergency, "Неизвестно", "Не применимо", "Не применимо", "Не применимо"
 
-        location_prompt = f"""
-        Извлеки из текста название города или региона, если они упомянуты. Если локация не указана, верни "Неизвестно". Ответь только названием локации или "Неизвестно":
+    location_prompt = f"""
+    Извлеки из текста название города или региона, если они упомянуты. Если локация не указана, верни "Неизвестно". Ответь только названием локации или "Неизвестно":
 
-        Текст: "{text}"
-        """
-        location_data = {
-            "contents": [{"parts": [{"text": location_prompt}]}]
-        }
+    Текст: "{text}"
+    """
+    location_data = {
+        "contents": [{"parts": [{"text": location_prompt}]}]
+    }
 
-        async with session.post(url, headers=headers, json=location_data) as response:
-            if response.status == 200:
-                result = await response.json()
-                location = result["candidates"][0]["content"]["parts"][0]["text"].strip()
-            else:
-                print(f"Ошибка извлечения локации: {response.status}")
-                location = "Неизвестно"
-
-        problem_solution_prompt = f"""
-        Проанализируй следующий текст о чрезвычайной ситуации. Опиши кратко:
-        1. Проблему (что произошло).
-        2. Решение или актуальную информацию о безопасности (что делается или что нужно делать).
-
-        Формат ответа:
-        Проблема: [описание проблемы]
-        Решение: [описание решения или мер безопасности]
-
-        Текст: "{text}"
-        """
-        problem_solution_data = {
-            "contents": [{"parts": [{"text": problem_solution_prompt}]}]
-        }
+    async with session.post(url, headers=headers, json=location_data) as response:
+        if response.status == 200:
+            result = await response.json()
+            location = result["candidates"][0]["content"]["parts"][0]["text"].strip()
+        else:
+            print(f"Ошибка извлечения локации: {response.status}")
+            location = "Неизвестно"
 
-        async with session.post(url, headers=headers, json=problem_solution_data) as response:
-            if response.status == 200:
-                result = await response.json()
-                ps_text = result["candidates"][0]["content"]["parts"][0]["text"].strip()
-                problem = "Неизвестно"
-                solution = "Неизвестно"
-                for line in ps_text.split('\n'):
-                    if line.startswith("Проблема:"):
-                        problem = line.replace("Проблема:", "").strip()
-                    elif line.startswith("Решение:"):
-                        solution = line.replace("Решение:", "").strip()
-            else:
-                print(f"Ошибка извлечения проблемы и решения: {response.status}")
-                problem = "Неизвестно"
-                solution = "Неизвестно"
+    problem_solution_prompt = f"""
+    Проанализируй следующий текст о чрезвычайной ситуации. Опиши кратко:
+    1. Проблему (что произошло).
+    2. Решение или актуальную информацию о безопасности (что делается или что нужно делать).
 
-        user_solution_prompt = f"""
-        На основе следующего текста о чрезвычайной ситуации дай краткие рекомендации, что делать людям в этой ситуации. Ответь только рекомендациями:
+    Формат ответа:
+    Проблема: [описание проблемы]
+    Решение: [описание решения или мер безопасности]
 
-        Текст: "{text}"
-        """
-        user_solution_data = {
-            "contents": [{"parts": [{"text": user_solution_prompt}]}]
-        }
+    Текст: "{text}"
+    """
+    problem_solution_data = {
+        "contents": [{"parts": [{"text": problem_solution_prompt}]}]
+    }
 
-        async with session.post(url, headers=headers, json=user_solution_data) as response:
-            if response.status == 200:
-                result = await response.json()
-                solution_user = result["candidates"][0]["content"]["parts"][0]["text"].strip()
-            else:
-                print(f"Ошибка извлечения рекомендаций для пользователей: {response.status}")
-                solution_user = "Неизвестно"
+    async with session.post(url, headers=headers, json=problem_solution_data) as response:
+        if response.status == 200:
+            result = await response.json()
+            ps_text = result["candidates"][0]["content"]["parts"][0]["text"].strip()
+            problem = "Неизвестно"
+            solution = "Неизвестно"
+            for line in ps_text.split('\n'):
+                if line.startswith("Проблема:"):
+                    problem = line.replace("Проблема:", "").strip()
+                elif line.startswith("Решение:"):
+                    solution = line.replace("Решение:", "").strip()
+        else:
+            print(f"Ошибка извлечения проблемы и решения: {response.status}")
+            problem = "Неизвестно"
+            solution = "Неизвестно"
+
+    user_solution_prompt = f"""
+    На основе следующего текста о чрезвычайной ситуации дай краткие рекомендации, что делать людям в этой ситуации. Ответь только рекомендациями:
+
+    Текст: "{text}"
+    """
+    user_solution_data = {
+        "contents": [{"parts": [{"text": user_solution_prompt}]}]
+    }
+
+    async with session.post(url, headers=headers, json=user_solution_data) as response:
+        if response.status == 200:
+            result = await response.json()
+            solution_user = result["candidates"][0]["content"]["parts"][0]["text"].strip()
+        else:
+            print(f"Ошибка извлечения рекомендаций для пользователей: {response.status}")
+            solution_user = "Неизвестно"
 
     return is_emergency, location, problem, solution, solution_user
 
-async def send_to_typescript_backend(data):
-    url = "http://192.168.0.163:4004/emergency"  # Замените на реальный URL
-    headers = {"Content-Type": "application/json"}
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "is_emergency": {"type": "BOOLEAN"},
+        "location": {"type": "STRING"},
+        "problem": {"type": "STRING"},
+        "solution": {"type": "STRING"},
+        "solution_user": {"type": "STRING"}
+    },
+    "required": ["is_emergency", "location", "problem", "solution", "solution_user"]
+}
+
+NOT_EMERGENCY = (False, "Неизвестно", "Не применимо", "Не применимо", "Не применимо")
+
+def parse_structured_analysis(raw):
+    data = json.loads(raw)
+    if not isinstance(data, dict) or not isinstance(data.get("is_emergency"), bool):
+        raise ValueError(f"Некорректный ответ Gemini: {raw}")
+    if not data["is_emergency"]:
+        return NOT_EMERGENCY
+
+    def field(name):
+        value = data.get(name)
+        if not isinstance(value, str) or not value.strip():
+            return "Неизвестно"
+        return value.strip()
+
+    return True, field("location"), field("problem"), field("solution"), field("solution_user")
+
+async def analyze_with_gemini_structured(text):
+    headers = {
+        "Content-Type": "application/json",
+        "x-goog-api-key": GEMINI_API_KEY
+    }
+
+    prompt = f"""
+    Проанализируй следующий текст и определи, является ли он сообщением о чрезвычайной ситуации (ЧП), например, аварии, пожаре, наводнении, теракте и т.д.
+    Если это ЧП, заполни поля:
+    - location: название города или региона из текста, или "Неизвестно", если локация не указана;
+    - problem: кратко, что произошло;
+    - solution: что делается или актуальная информация о безопасности;
+    - solution_user: краткие рекомендации, что делать людям в этой ситуации.
+    Если это не ЧП, верни is_emergency = false, а остальные поля оставь пустыми.
+
+    Текст: "{text}"
+    """
+    data = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": ANALYSIS_SCHEMA
+        }
+    }
+
+    session = await get_http_session()
+    try:
+        async with session.post(GEMINI_URL, headers=headers, json=data) as response:
+            if response.status != 200:
+                print(f"Ошибка анализа текста: {response.status}")
+                return None
+            result = await response.json()
+        raw = result["candidates"][0]["content"]["parts"][0]["text"]
+        return parse_structured_analysis(raw)
+    except (KeyError, IndexError, ValueError) as e:
+        print(f"Ошибка разбора ответа Gemini: {e}")
+        return None
+
+async def analyze_with_gemini(text):
+    # Явно не ЧП отсекаем локально, без запроса к Gemini
+    if PREFILTER_ENABLED:
+        prefilter_stats["checked"] += 1
+        if prefilter.score(text) < PREFILTER_THRESHOLD:
+            ANALYSIS.labels("prefiltered").inc()
+            return NOT_EMERGENCY
+        prefilter_stats["passed"] += 1
+
+    try:
+        with span("analysis_cache.get"):
+            cached = await analysis_cache.get(text)
+    except Exception as e:
+        print(f"Ошибка чтения кэша анализа: {e}")
+        ERRORS.labels("analysis_cache").inc()
+        cached = None
+    if cached:
+        ANALYSIS.labels("cache_hit").inc()
+        return cached
+
+    with span("gemini", mode=GEMINI_MODE), timed(GEMINI_SECONDS.labels(GEMINI_MODE)):
+        try:
+            if GEMINI_MODE == "sequential":
+                result = await analyze_with_gemini_sequential(text)
+            else:
+                result = await analyze_with_gemini_structured(text)
+        except Exception:
+            ERRORS.labels("gemini").inc()
+            raise
+    # Ошибка Gemini (None) — не «не ЧП»: пачка уходит на повтор через очередь, строки в news не пишутся,
+    # иначе дедупликация по news_link больше не даст проанализировать сообщение
+    if result is None:
+        ERRORS.labels("gemini").inc()
+        ANALYSIS.labels("gemini_error").inc()
+        raise RuntimeError("Gemini не вернул результат анализа")
+    ANALYSIS.labels("emergency" if result[0] else "not_emergency").inc()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                if response.status == 200:
-                    print(f"Данные ЧП успешно отправлены в TypeScript-бэкенд: {data}")
-                else:
-                    print(f"Ошибка отправки в TypeScript-бэкенд: {response.status}")
+        await analysis_cache.put(text, result)
     except Exception as e:
-        print(f"Ошибка при отправке в TypeScript-бэкенд: {e}")
+        print(f"Ошибка записи в кэш анализа: {e}")
+        ERRORS.labels("analysis_cache").inc()
+    return result
+
+delivery = EmergencyDelivery(
+    get_http_session,
+    BACKEND_URL + "/emergency/batch",
+    outbox_path=backend_config.get("outbox_path", "emergency_outbox.db"),
+    batch_window=backend_config.get("batch_window", 0.5),
+    max_batch=backend_config.get("max_batch", 50),
+    max_batch_bytes=backend_config.get("max_batch_bytes", 512 * 1024),
+    max_attempts=backend_config.get("max_attempts", 20),
+    base_backoff=backend_config.get("base_backoff", 1.0),
+    max_backoff=backend_config.get("max_backoff", 300.0)
+)
+
+async def send_to_typescript_backend(data, posted_at=None, trace=None):
+    # Отправка асинхронная: запись попадает в outbox, доставкой пачками занимается delivery.run()
+    with continue_span("emergency.enqueue", trace, news_link=data["news_link"]):
+        await delivery.enqueue(data, posted_at, inject())
 
 async def init_db():
-    conn = await asyncpg.connect(**db_config)
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS sources (
-            id SERIAL PRIMARY KEY,
-            link TEXT NOT NULL,
-            name TEXT NOT NULL,
-            type TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT NOW()
-        );
-
-        CREATE TABLE IF NOT EXISTS news (
-            id SERIAL PRIMARY KEY,
-            news_link TEXT NOT NULL,
-            source_id INTEGER NOT NULL REFERENCES sources(id),
-            news_title TEXT NOT NULL,
-            news_body TEXT NOT NULL,
-            summary TEXT NULL,
-            problem TEXT NULL,
-            solution TEXT NULL,
-            solution_user TEXT NULL,
-            created_at TIMESTAMP DEFAULT NOW()
-        );
-    """)
-    await conn.close()
+    async with acquire() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS sources (
+                id SERIAL PRIMARY KEY,
+                link TEXT NOT NULL,
+                name TEXT NOT NULL,
+                type TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW()
+            );
+
+            ALTER TABLE sources ADD COLUMN IF NOT EXISTS last_message_id BIGINT NULL;
+
+            CREATE TABLE IF NOT EXISTS news (
+                id SERIAL PRIMARY KEY,
+                news_link TEXT NOT NULL,
+                source_id INTEGER NOT NULL REFERENCES sources(id),
+                news_title TEXT NOT NULL,
+                news_body TEXT NOT NULL,
+                summary TEXT NULL,
+                problem TEXT NULL,
+                solution TEXT NULL,
+                solution_user TEXT NULL,
+                created_at TIMESTAMP DEFAULT NOW()
+            );
+
+            -- Убираем старые дубли, иначе уникальный индекс не создастся
+            DELETE FROM news a USING news b
+            WHERE a.news_link = b.news_link AND a.id > b.id
+              AND NOT EXISTS (
+                  SELECT 1 FROM pg_indexes WHERE tablename = 'news' AND indexname = 'news_news_link_key'
+              );
+
+            CREATE UNIQUE INDEX IF NOT EXISTS news_news_link_key ON news (news_link);
+
+            CREATE TABLE IF NOT EXISTS private_channels (
+                id SERIAL PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                invite_link TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW(),
+                UNIQUE (user_id, invite_link)
+            );
+        """)
+        await analysis_cache.init_table(conn)
 
 async def get_or_create_source(channel_id, channel_name):
-    conn = await asyncpg.connect(**db_config)
     try:
-        source = await conn.fetchrow("""
-            SELECT id FROM sources WHERE link = $1
-        """, channel_id)
-        if not source:
+        async with acquire() as conn:
             source = await conn.fetchrow("""
-                INSERT INTO sources (link, name, type)
-                VALUES ($1, $2, 'telegram')
-                RETURNING id
-            """, channel_id, channel_name)
-        return source['id']
+                SELECT id FROM sources WHERE link = $1
+            """, channel_id)
+            if not source:
+                source = await conn.fetchrow("""
+                    INSERT INTO sources (link, name, type)
+                    VALUES ($1, $2, 'telegram')
+                    RETURNING id
+                """, channel_id, channel_name)
+            return source['id']
     except Exception as e:
         print(f'Ошибка в get_or_create_source: {e}')
-    finally:
-        await conn.close()
 
-async def save_news_if_not_exists(source_id, message):
-    conn = await asyncpg.connect(**db_config)
+async def get_source_cursor(source_id):
+    async with acquire() as conn:
+        return await conn.fetchval("""
+            SELECT last_message_id FROM sources WHERE id = $1
+        """, source_id)
+
+async def update_source_cursor(source_id, message_id):
+    async with acquire() as conn:
+        await conn.execute("""
+            UPDATE sources SET last_message_id = GREATEST(COALESCE(last_message_id, 0), $2)
+            WHERE id = $1
+        """, source_id, message_id)
+
+async def private_channel_exists(user_id, invite_link):
+    async with acquire() as conn:
+        return await conn.fetchval(
+            "SELECT 1 FROM private_channels WHERE user_id = $1 AND invite_link = $2",
+            user_id, invite_link
+        ) is not None
+
+async def private_channels_add(user_id, invite_link):
+    async with acquire() as conn:
+        await conn.execute("""
+            INSERT INTO private_channels (user_id, invite_link)
+            VALUES ($1, $2)
+            ON CONFLICT DO NOTHING
+        """, user_id, invite_link)
+
+def prepare_news(message):
+    created_at = message['created_at']
+    if isinstance(created_at, str):
+        created_at = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S')
+    created_at = created_at.replace(tzinfo=None)
+    body_text = message['body'].strip()
+    title = body_text.split('.')[0] if '.' in body_text else message['body']
+    return title, created_at
+
+async def filter_new_links(links):
+    if not links:
+        return set()
+    async with acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT news_link FROM news WHERE news_link = ANY($1::text[])
+        """, list(links))
+    existing = {row['news_link'] for row in rows}
+    return {link for link in links if link not in existing}
+
+async def insert_news_batch(rows):
+    # Одна вставка на пачку; RETURNING отдаёт только реально вставленные ссылки
+    if not rows:
+        return set()
+    columns = list(zip(*rows))
+    async with acquire() as conn:
+        inserted = await conn.fetch("""
+            INSERT INTO news (news_link, source_id, news_title, news_body, problem, solution, solution_user, created_at)
+            SELECT * FROM unnest($1::text[], $2::int[], $3::text[], $4::text[], $5::text[], $6::text[], $7::text[], $8::timestamp[])
+            ON CONFLICT (news_link) DO NOTHING
+            RETURNING news_link
+        """, *[list(column) for column in columns])
+    return {row['news_link'] for row in inserted}
+
+gemini_semaphore = None
+
+async def analyze_limited(text, trace=None):
+    global gemini_semaphore
+    if gemini_semaphore is None:
+        gemini_semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
+    # Трасса сообщения продолжается после очереди: ожидание семафора, кэш, Gemini
+    with continue_span("news.analyze", trace):
+        async with gemini_semaphore:
+            return await analyze_with_gemini(text)
+
+async def save_news_batch(source_id, messages):
     try:
-        exists = await conn.fetchrow("""
-            SELECT id FROM news WHERE news_link = $1
-        """, message['news_link'])
-        if not exists:
-            created_at = message['created_at']
-            if isinstance(created_at, str):
-                created_at = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S')
-            created_at = created_at.replace(tzinfo=None)
-            body_text = message['body'].strip()
-            title = body_text.split('.')[0] if '.' in body_text else message['body']
-
-            is_emergency, location, problem, solution, solution_user = await analyze_with_gemini(message['body'])
-
-            await conn.execute("""
-                INSERT INTO news (news_link, source_id, news_title, news_body, problem, solution, solution_user, created_at)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-            """, message['news_link'], source_id, title, message['body'], problem, solution, solution_user, created_at)
-
+        new_links = await filter_new_links({message['news_link'] for message in messages})
+        if not new_links:
+            return
+        print(f"Новых сообщений в пачке: {len(new_links)} из {len(messages)}")
+
+        fresh = []
+        for message in messages:
+            if message['news_link'] in new_links:
+                new_links.discard(message['news_link'])
+                fresh.append(message)
+
+        # Соединение не держим, пока ждём ответ Gemini; одновременных запросов не больше GEMINI_CONCURRENCY
+        analyses = await asyncio.gather(*(analyze_limited(message['body'], message.get('trace'))
+                                          for message in fresh))
+
+        rows = []
+        emergencies = {}
+        posted_at = {}
+        traces = {}
+        for message, analysis in zip(fresh, analyses):
+            title, created_at = prepare_news(message)
+            is_emergency, location, problem, solution, solution_user = analysis
+
+            rows.append((message['news_link'], source_id, title, message['body'],
+                         problem, solution, solution_user, created_at))
             if is_emergency:
-                emergency_data = {
+                emergencies[message['news_link']] = {
                     "news_link": message['news_link'],
                     "title": title,
                     "body": message['body'],
@@ -232,35 +565,102 @@ async def save_news_if_not_exists(source_id, message):
                     "solution_user": solution_user,
                     "created_at": message['created_at']
                 }
-                await send_to_typescript_backend(emergency_data)
+                if message.get('posted_at'):
+                    posted_at[message['news_link']] = message['posted_at']
+                traces[message['news_link']] = message.get('trace')
+
+        # Сначала outbox, потом news: если запись в outbox упадёт, пачка уйдёт на повтор целиком.
+        # В обратном порядке повтор увидел бы ссылки в news и ЧП потерялось бы. Доставка — «хотя бы раз»:
+        # при повторе после сбоя вставки ЧП может уйти в бэкенд дважды, news_link в нём одинаковый
+        for news_link, emergency_data in emergencies.items():
+            await send_to_typescript_backend(emergency_data, posted_at.get(news_link), traces.get(news_link))
+        await insert_news_batch(rows)
     except Exception as e:
-        print(f'Ошибка в save_news_if_not_exists: {e}')
-    finally:
-        await conn.close()
+        print(f'Ошибка в save_news_batch: {e}')
+        ERRORS.labels("save_news").inc()
+        # Очередь вернёт пачку на повтор
+        raise
+
+work_queue = None
+
+async def enqueue_batch(source_id, batch):
+    # В памяти очередь ограничена: если воркеры не успевают, чтение каналов притормаживает.
+    # Для очереди в памяти возвращает future сохранения пачки, иначе None
+    if work_queue is None:
+        await save_news_batch(source_id, batch)
+        return None
+    saved = await work_queue.publish({"source_id": source_id, "messages": batch})
+    return None if work_queue.durable else saved
+
+async def commit_cursor(source_id, pending, message_id):
+    # Курсор двигаем, только когда пачки не потеряются при падении: сохранены в БД или лежат в надёжной очереди.
+    # Если пачка так и не сохранилась, курсор остаётся, и следующее чтение заберёт её снова
+    await asyncio.gather(*(saved for saved in pending if saved is not None))
+    await update_source_cursor(source_id, message_id)
+
+async def handle_queued_batch(payload):
+    await save_news_batch(payload["source_id"], payload["messages"])
+
+def message_to_data(message, bd_news_link, mode="poll"):
+    data = {
+        "news_link": f"{bd_news_link}/{message.id}",
+        "body": message.message,
+        "created_at": message.date.astimezone(local_tz).strftime('%Y-%m-%d %H:%M:%S'),
+        "posted_at": message.date.timestamp()
+    }
+    MESSAGES.labels(mode).inc()
+    # Выборочная трассировка: контекст едет вместе с сообщением через очередь до POST /emergency
+    with root_span("telegram.message", news_link=data["news_link"], mode=mode):
+        trace = inject()
+    if trace:
+        data["trace"] = trace
+    return data
+
+def channel_username_from(channel_id):
+    if channel_id.startswith("https://t.me/+"):
+        return f'+{channel_id.split("+")[-1]}'
+    if channel_id.startswith("https://t.me/"):
+        return channel_id.split("https://t.me/")[1]
+    return channel_id
 
 async def fetch_recent_messages(client, channel_id, channel_username):
+    with timed(FETCH_SECONDS.labels("poll")):
+        return await fetch_recent_messages_timed(client, channel_id, channel_username)
+
+async def fetch_recent_messages_timed(client, channel_id, channel_username):
     try:
         channel = await client.get_entity(channel_id)
         print(f"\nЧтение сообщений из канала: {channel.title}...")
         source_id = await get_or_create_source(channel_id, channel.title)
-        local_tz = pytz.timezone("Asia/Almaty")
         bd_news_link = 'https://t.me/' + channel_username
-
-        async for message in client.iter_messages(channel):
-            message_time = message.date.astimezone(local_tz).strftime('%Y-%m-%d %H:%M:%S')
-            if message_time < time_limit:
+        last_message_id = await get_source_cursor(source_id)
+        time_limit = datetime.now(pytz.utc) - COLD_START_WINDOW
+        newest_id = last_message_id or 0
+        batch = []
+        pending = []
+
+        # min_id отдаёт только сообщения новее курсора
+        async for message in client.iter_messages(channel, min_id=last_message_id or 0):
+            newest_id = max(newest_id, message.id)
+            if not last_message_id and message.date < time_limit:
                 print(f"Сообщение старое, остановка обработки сообщений.")
                 break
-            if message_time >= time_limit and message.message and message.message.strip():
-                bd_news_link_full = f"{bd_news_link}/{message.id}"
-                message_data = {
-                    "news_link": bd_news_link_full,
-                    "body": message.message,
-                    "created_at": message_time
-                }
-                await save_news_if_not_exists(source_id, message_data)
+            if message.message and message.message.strip():
+                batch.append(message_to_data(message, bd_news_link))
+                if len(batch) >= NEWS_BATCH_SIZE:
+                    pending.append(await enqueue_batch(source_id, batch))
+                    batch = []
+        if batch:
+            pending.append(await enqueue_batch(source_id, batch))
+        if newest_id and newest_id != last_message_id:
+            await commit_cursor(source_id, pending, newest_id)
+        return True
+    except errors.FloodWaitError:
+        raise
     except Exception as e:
         print(f"Ошибка чтения канала {channel_id}: {e}")
+        ERRORS.labels("fetch").inc()
+        return False
 
 async def join_and_fetch(client, channel_id):
     try:
@@ -271,78 +671,244 @@ async def join_and_fetch(client, channel_id):
             channel_username = f'+{invite_hash}'
             print(f"Используем инвайт-хеш: {invite_hash}")
             try:
-                conn = await asyncpg.connect(**db_config)
-                exists = await conn.fetchrow(
-                    "SELECT 1 FROM private_channels WHERE user_id = $1 AND invite_link = $2",
-                    user_id, channel_username
-                )
+                exists = await private_channel_exists(user_id, channel_username)
                 if not exists:
                     await client(ImportChatInviteRequest(invite_hash))
                     await private_channels_add(user_id, channel_username)
             except errors.UserAlreadyParticipantError:
                 print(f"Уже в канале {channel_id}, пропускаем присоединение")
-                exists = await conn.fetchrow(
-                    "SELECT 1 FROM private_channels WHERE user_id = $1 AND invite_link = $2",
-                    user_id, channel_username
-                )
+                exists = await private_channel_exists(user_id, channel_username)
                 if not exists:
                     await private_channels_add(user_id, channel_username)
-                await fetch_recent_messages(client, channel_id, channel_username)
-                return
+                return await fetch_recent_messages(client, channel_id, channel_username)
+            except errors.FloodWaitError:
+                raise
             except Exception as e:
                 print('Ошибка в try.try.except:', e)
-                return
-        elif channel_id.startswith("https://t.me/"):
-            channel_username = channel_id.split("https://t.me/")[1]
+                return False
         else:
-            channel_username = channel_id
+            channel_username = channel_username_from(channel_id)
 
         print(f"Получение сущности канала: {channel_username}")
-        await fetch_recent_messages(client, channel_id, channel_username)
+        return await fetch_recent_messages(client, channel_id, channel_username)
     except errors.InviteHashInvalidError:
         print(f"Инвайт-хеш {channel_id} недействителен или не существует.")
+        return False
     except errors.InviteHashExpiredError:
         print(f"Срок действия инвайт-ссылки истёк: {channel_id}")
+        return False
     except errors.UserAlreadyParticipantError:
         print(f"Вы уже присоединились к каналу {channel_id}.")
-        await fetch_recent_messages(client, channel_id, channel_username)
-    except errors.FloodWaitError as e:
-        print(f"Превышен лимит запросов. Подождите {e.seconds} секунд.")
-        await asyncio.sleep(e.seconds)
-        await join_and_fetch(client, channel_id)
+        return await fetch_recent_messages(client, channel_id, channel_username)
+    except errors.FloodWaitError:
+        # Ожидание делает fetch_channel, не занимая слот семафора
+        raise
     except Exception as e:
         print(f"Ошибка обработки канала {channel_id}: {e}")
         await asyncio.sleep(60)
-        await fetch_recent_messages(client, channel_id, channel_username)
+        return await fetch_recent_messages(client, channel_id, channel_username)
 
-async def process_account(account):
+async def fetch_channel(client, channel_id, semaphore):
+    # True — сообщения прочитаны до конца и курсор сохранён
+    for attempt in range(FLOOD_WAIT_RETRIES + 1):
+        try:
+            async with semaphore:
+                return await join_and_fetch(client, channel_id)
+        except errors.FloodWaitError as e:
+            if attempt == FLOOD_WAIT_RETRIES:
+                print(f"Канал {channel_id} пропущен: лимит запросов не снят после {FLOOD_WAIT_RETRIES} попыток")
+                return False
+            print(f"Превышен лимит запросов для {channel_id}. Подождите {e.seconds} секунд.")
+            await asyncio.sleep(e.seconds)
+
+def channels_for_account(channels, account, active):
+    # Каждый канал читает один аккаунт, иначе новый пост анализируется по разу на аккаунт.
+    # Делим только между подключившимися аккаунтами (active — в порядке конфига), чтобы каналы
+    # упавшего аккаунта не остались без чтения. Разбиение по хешу ссылки: добавление канала
+    # не перекидывает остальные на другие аккаунты
+    if account not in active:
+        return []
+    index = active.index(account)
+    return [channel_id for channel_id in channels
+            if zlib.crc32(channel_id.encode("utf-8")) % len(active) == index]
+
+async def connect_account(account):
     phone = account["phone"]
-    api_id = account["api_id"]
-    api_hash = account["api_hash"]
-    channels = await get_channels()
-    if not channels:
-        print('Нет каналов для обработки')
-        return
-    client = TelegramClient(phone, api_id, api_hash)
+    client = TelegramClient(phone, account["api_id"], account["api_hash"])
     try:
         print(f"\nПодключение аккаунта {phone}...")
         await client.start(phone=phone)
-        for channel_id in channels:
-            await join_and_fetch(client, channel_id)
+        return client
+    except Exception as e:
+        print(f"Ошибка подключения аккаунта {phone}: {e}")
+        await client.disconnect()
+        return None
+
+async def process_account(account, client, channels):
+    try:
+        semaphore = asyncio.Semaphore(CHANNELS_PER_ACCOUNT)
+        await asyncio.gather(*(fetch_channel(client, channel_id, semaphore) for channel_id in channels))
     except Exception as e:
-        print(f"Ошибка с аккаунтом {phone}: {e}")
+        print(f"Ошибка с аккаунтом {account['phone']}: {e}")
     finally:
         await client.disconnect()
 
-async def main():
-    await init_db()
+async def subscribe_channels(client, channels, caught_up):
+    # peer_id сущности -> (source_id, базовая ссылка для news_link, ссылка канала)
+    sources = {}
+    for channel_id in channels:
+        try:
+            entity = await client.get_entity(channel_id)
+            source_id = await get_or_create_source(channel_id, entity.title)
+            sources[utils.get_peer_id(entity)] = (source_id, 'https://t.me/' + channel_username_from(channel_id),
+                                                  channel_id)
+        except Exception as e:
+            print(f"Не удалось подписаться на канал {channel_id}: {e}")
+
+    async def on_new_message(event):
+        source = sources.get(event.chat_id)
+        message = event.message
+        if not source or not (message.message and message.message.strip()):
+            return
+        source_id, bd_news_link, channel_id = source
+        try:
+            saved = await enqueue_batch(source_id, [message_to_data(message, bd_news_link, "realtime")])
+            # Пока канал не догнан по курсору, курсор двигает только догоняющее чтение,
+            # иначе GREATEST перескочит сообщения, которые оно ещё не прочитало
+            if channel_id in caught_up:
+                await commit_cursor(source_id, [saved], message.id)
+        except Exception as e:
+            print(f"Ошибка обработки нового сообщения {event.chat_id}/{message.id}: {e}")
+            ERRORS.labels("realtime").inc()
+
+    client.add_event_handler(on_new_message, events.NewMessage(chats=list(sources)))
+    return sources
+
+# Телефоны аккаунтов realtime, у которых сейчас есть соединение
+online_phones = set()
+
+def online_accounts():
+    return [account for account in accounts if account["phone"] in online_phones]
+
+async def run_account_realtime(account):
+    phone = account["phone"]
     while True:
-        for account in accounts:
-            print(f"\n--- Начинаем работу с аккаунтом {account['phone']} ---")
-            await process_account(account)
+        client = TelegramClient(phone, account["api_id"], account["api_hash"])
+        try:
+            print(f"\nПодключение аккаунта {phone} (realtime)...")
+            await client.start(phone=phone)
+            online_phones.add(phone)
+            channels = channels_for_account(await get_channels(), account, online_accounts())
+            # Сначала подписка, потом догоняем пропущенное за время отключения:
+            # пост, пришедший во время догона, не теряется, пересечение отсекает дедупликация
+            caught_up = set()
+            sources = await subscribe_channels(client, channels, caught_up)
+            print(f"Аккаунт {phone} подписан на {len(sources)} каналов")
+            semaphore = asyncio.Semaphore(CHANNELS_PER_ACCOUNT)
+
+            async def catch_up(channel_id):
+                if await fetch_channel(client, channel_id, semaphore):
+                    caught_up.add(channel_id)
+
+            await asyncio.gather(*(catch_up(channel_id) for channel_id in channels))
+
+            disconnected = client.disconnected
+            while not disconnected.done():
+                await asyncio.wait([disconnected], timeout=CHANNEL_REFRESH_INTERVAL)
+                # Неудавшийся догон повторяем: до него курсор канала стоит на месте
+                lagging = [channel_id for channel_id in channels if channel_id not in caught_up]
+                if lagging and not disconnected.done():
+                    await asyncio.gather(*(catch_up(channel_id) for channel_id in lagging))
+                # Сюда же попадает смена состава подключённых аккаунтов: каналы упавшего
+                # перераспределяются на остальные при их ближайшей проверке
+                if not disconnected.done() and set(channels_for_account(
+                        await get_channels(), account, online_accounts())) != set(channels):
+                    print(f"Список каналов изменился, переподписываем аккаунт {phone}")
+                    break
+            if disconnected.done():
+                online_phones.discard(phone)
+        except Exception as e:
+            online_phones.discard(phone)
+            print(f"Ошибка с аккаунтом {phone}: {e}")
+        finally:
+            await client.disconnect()
+        await asyncio.sleep(RECONNECT_DELAY)
+
+async def print_stats():
+    print_pool_stats()
+    analysis_cache.print_stats()
+    try:
+        await analysis_cache.evict()
+    except Exception as e:
+        print(f"Ошибка очистки кэша анализа: {e}")
+    if prefilter_stats["checked"]:
+        print(f"Префильтр: в Gemini ушло {prefilter_stats['passed']} из {prefilter_stats['checked']}")
+    try:
+        await delivery.print_stats()
+    except Exception as e:
+        print(f"Ошибка чтения статистики доставки: {e}")
+    if work_queue is not None:
+        try:
+            depth = await work_queue.depth()
+            QUEUE_DEPTH.labels("analysis").set(depth)
+            print(f"Очередь анализа: {depth} задач")
+        except Exception as e:
+            print(f"Ошибка чтения глубины очереди: {e}")
+
+async def stats_loop():
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        await print_stats()
+
+async def run_polling():
+    while True:
+        channels = await get_channels()
+        if channels:
+            print(f"\n--- Начинаем работу с аккаунтами: {', '.join(a['phone'] for a in accounts)} ---")
+            clients = await asyncio.gather(*(connect_account(account) for account in accounts))
+            connected = [account for account, client in zip(accounts, clients) if client]
+            await asyncio.gather(*(process_account(account, client, channels_for_account(channels, account, connected))
+                                   for account, client in zip(accounts, clients) if client))
+            if ROLE == "all":
+                await work_queue.join()
+        else:
+            print('Нет каналов для обработки')
+        await print_stats()
         print("\n--- Ожидание следующего запуска (1 минута) ---")
         await asyncio.sleep(60)
 
+async def run_realtime():
+    await asyncio.gather(stats_loop(), *(run_account_realtime(account) for account in accounts))
+
+async def run_worker():
+    await asyncio.gather(stats_loop(), work_queue.consume(handle_queued_batch, ANALYSIS_WORKERS))
+
+async def main():
+    global work_queue
+    if telemetry_config.get("metrics_port"):
+        start_exporter(telemetry_config["metrics_port"], telemetry_config.get("metrics_addr", "0.0.0.0"))
+    setup_tracing(telemetry_config.get("trace_sample_rate", 0.0), telemetry_config.get("otlp_endpoint"))
+    await init_pool()
+    work_queue = create_queue(queue_config, config.get("rabbitmq", {}), default_size=QUEUE_SIZE, role=ROLE)
+    await work_queue.connect()
+    await delivery.init()
+    workers = [asyncio.create_task(delivery.run())]
+    if ROLE == "all":
+        workers.append(asyncio.create_task(work_queue.consume(handle_queued_batch, ANALYSIS_WORKERS)))
+    try:
+        await init_db()
+        if ROLE == "worker":
+            await run_worker()
+        elif INGEST_MODE == "realtime":
+            await run_realtime()
+        else:
+            await run_polling()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await work_queue.close()
+        await close_http_session()
+        await close_pool()
+
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,181 @@
+import json
+import math
+import os
+import random
+import re
+import sys
+import zlib
+
+# Локальный первичный фильтр: словарь основ + линейная модель на хешированных признаках.
+# Работает без сети; в Gemini уходят только сообщения со score выше порога.
+
+# Казахские буквы тоже, иначе «Алматыда өрт шықты» распадается на обрывки
+TOKEN_RE = re.compile(r"[a-zа-яәғқңөұүһі0-9]+")
+STEM_LENGTH = 6
+HASH_BITS = 18
+
+EMERGENCY_STEMS = [
+    "чп", "чс", "мчс", "дтп", "пожар", "горит", "горел", "возгоран", "задымлен", "взрыв", "взорв",
+    "авари", "катастроф", "крушен", "обрушен", "обвал", "наводнен", "паводк", "паводок", "подтоплен",
+    "затоплен", "землетрясен", "толчк", "селев", "лавин", "ураган", "смерч", "буран", "метел",
+    "теракт", "террорист", "стрельб", "выстрел", "захват", "залож", "минирован", "эвакуац", "эвакуир",
+    "погиб", "гибел", "пострада", "ранен", "госпитализ", "спасател", "утечк", "отравлен",
+    "пропал", "тонул", "утонул", "оцеплен", "бомб", "угроз", "нападен", "убит", "убийств",
+    # казахские основы
+    "өрт", "жарыл", "апат", "тасқын", "зілзала", "қаза", "зардап", "құтқар", "эвакуа",
+]
+
+DEFAULT_WEIGHTS = {
+    "bias": -1.0,
+    "lexicon": 2.0,
+    "features": {}
+}
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def stem(token):
+    # Грубая «лемма»: обрезаем окончание, этого хватает для русских словоформ
+    return token[:STEM_LENGTH]
+
+
+def lexicon_hits(tokens):
+    return sum(1 for token in tokens if any(token.startswith(s) for s in EMERGENCY_STEMS))
+
+
+def hashed_features(tokens):
+    stems = [stem(token) for token in tokens]
+    grams = stems + [f"{a}_{b}" for a, b in zip(stems, stems[1:])]
+    features = {}
+    for gram in grams:
+        index = zlib.crc32(gram.encode("utf-8")) & ((1 << HASH_BITS) - 1)
+        features[index] = features.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+    return {k: v / norm for k, v in features.items()}
+
+
+def sigmoid(x):
+    if x < -30:
+        return 0.0
+    if x > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+class Prefilter:
+    def __init__(self, weights=None):
+        # Без обученной модели фильтр не включается: веса по умолчанию отсекают всё, где нет основ из словаря
+        self.trained = weights is not None
+        weights = weights or DEFAULT_WEIGHTS
+        self.bias = weights["bias"]
+        self.lexicon = weights["lexicon"]
+        self.features = {int(k): v for k, v in weights["features"].items()}
+
+    @classmethod
+    def load(cls, path):
+        if path and os.path.exists(path):
+            with open(path) as f:
+                return cls(json.load(f))
+        return cls()
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "bias": self.bias,
+                "lexicon": self.lexicon,
+                "features": {str(k): v for k, v in self.features.items() if v}
+            }, f)
+
+    def _margin(self, hits, features):
+        margin = self.bias + self.lexicon * math.log1p(hits)
+        for index, value in features.items():
+            margin += self.features.get(index, 0.0) * value
+        return margin
+
+    def score(self, text):
+        tokens = tokenize(text or "")
+        if not tokens:
+            return 0.0
+        return sigmoid(self._margin(lexicon_hits(tokens), hashed_features(tokens)))
+
+    def train(self, samples, epochs=10, learning_rate=0.5, l2=1e-4, seed=0):
+        # Логистическая регрессия, SGD; samples — список (text, label)
+        prepared = []
+        for text, label in samples:
+            tokens = tokenize(text)
+            prepared.append((lexicon_hits(tokens), hashed_features(tokens), 1.0 if label else 0.0))
+        rng = random.Random(seed)
+        self.trained = True
+        for _ in range(epochs):
+            rng.shuffle(prepared)
+            for hits, features, y in prepared:
+                gradient = sigmoid(self._margin(hits, features)) - y
+                self.bias -= learning_rate * gradient
+                self.lexicon -= learning_rate * (gradient * math.log1p(hits) + l2 * self.lexicon)
+                for index, value in features.items():
+                    weight = self.features.get(index, 0.0)
+                    self.features[index] = weight - learning_rate * (gradient * value + l2 * weight)
+
+
+def evaluate(prefilter, samples, thresholds):
+    scored = [(prefilter.score(text), bool(label)) for text, label in samples]
+    positives = sum(1 for _, label in scored if label)
+    report = []
+    for threshold in thresholds:
+        tp = sum(1 for score, label in scored if score >= threshold and label)
+        fp = sum(1 for score, label in scored if score >= threshold and not label)
+        fn = positives - tp
+        passed = tp + fp
+        report.append({
+            "threshold": threshold,
+            "precision": tp / passed if passed else 1.0,
+            "recall": tp / positives if positives else 1.0,
+            "passed_to_llm": passed / len(scored) if scored else 0.0,
+            "missed": fn
+        })
+    return report
+
+
+def load_samples(path):
+    # JSONL: {"text": "...", "label": true/false}
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                samples.append((row["text"], bool(row["label"])))
+    return samples
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in ("train", "report"):
+        print("Использование: python prefilter.py train|report labeled.jsonl [model.json]")
+        return 1
+    command, samples_path = argv[1], argv[2]
+    model_path = argv[3] if len(argv) > 3 else "prefilter_model.json"
+    samples = load_samples(samples_path)
+
+    if command == "train":
+        rng = random.Random(0)
+        rng.shuffle(samples)
+        split = max(1, int(len(samples) * 0.8))
+        train, test = samples[:split], samples[split:] or samples
+        prefilter = Prefilter()
+        prefilter.train(train)
+        prefilter.save(model_path)
+        print(f"Модель сохранена в {model_path}, обучено на {len(train)}, проверка на {len(test)}")
+    else:
+        prefilter = Prefilter.load(model_path)
+        test = samples
+
+    print(f"{'порог':>6} {'precision':>10} {'recall':>8} {'в LLM':>7} {'пропущено':>10}")
+    for row in evaluate(prefilter, test, [i / 20 for i in range(1, 20)]):
+        print(f"{row['threshold']:>6.2f} {row['precision']:>10.3f} {row['recall']:>8.3f} "
+              f"{row['passed_to_llm']:>7.1%} {row['missed']:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,151 @@
+import random
+import time
+from contextlib import contextmanager, nullcontext
+
+# Метрики Prometheus и выборочная трассировка парсера.
+# prometheus_client и opentelemetry необязательны: без них метрики и спаны ничего не делают.
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import propagate, trace
+except ImportError:
+    trace = None
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, value=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DELIVERY_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _histogram(name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Histogram(name, documentation, labels, buckets=buckets)
+
+
+def _counter(name, documentation, labels=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, documentation, labels)
+
+
+def _gauge(name, documentation, labels=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Gauge(name, documentation, labels)
+
+
+FETCH_SECONDS = _histogram("parser_fetch_seconds", "Чтение одного канала Telegram", ["mode"])
+MESSAGES = _counter("parser_messages_total", "Прочитанные сообщения Telegram", ["mode"])
+DB_SECONDS = _histogram("parser_db_seconds", "Ожидание соединения и работа с БД", ["stage"])
+GEMINI_SECONDS = _histogram("parser_gemini_seconds", "Запрос анализа в Gemini", ["mode"])
+ANALYSIS = _counter("parser_analysis_total", "Итог анализа сообщения", ["outcome"])
+DELIVERY_SECONDS = _histogram("parser_delivery_post_seconds", "POST пачки ЧП в бэкенд")
+DELIVERY_LATENCY = _histogram("parser_delivery_latency_seconds", "Задержка от публикации поста до доставки ЧП",
+                              buckets=DELIVERY_BUCKETS)
+DELIVERED = _counter("parser_emergencies_total", "ЧП, обработанные доставкой", ["result"])
+QUEUE_DEPTH = _gauge("parser_queue_depth", "Глубина очередей", ["queue"])
+ERRORS = _counter("parser_errors_total", "Ошибки по этапам", ["stage"])
+
+
+@contextmanager
+def timed(histogram):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started)
+
+
+def start_exporter(port, addr="0.0.0.0"):
+    if prometheus_client is None:
+        print("prometheus_client не установлен, экспорт метрик выключен")
+        return False
+    prometheus_client.start_http_server(port, addr)
+    print(f"Метрики Prometheus: http://{addr}:{port}/metrics")
+    return True
+
+
+tracer = None
+sample_rate = 0.0
+
+
+def setup_tracing(rate, endpoint=None, service_name="monitoring-news"):
+    # Спаны создаются только для доли rate сообщений; экспорт в OTLP, если есть экспортёр, иначе в консоль
+    global tracer, sample_rate
+    if rate <= 0:
+        return False
+    if trace is None:
+        print("opentelemetry не установлен, трассировка выключена")
+        return False
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter(endpoint=endpoint) if endpoint else OTLPSpanExporter()
+    except ImportError:
+        exporter = ConsoleSpanExporter()
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    tracer = trace.get_tracer(service_name)
+    sample_rate = rate
+    return True
+
+
+def root_span(name, **attributes):
+    # Начало трассы сообщения: решение о выборке принимается здесь, дочерние спаны идут только внутри неё
+    if tracer is None or random.random() >= sample_rate:
+        return nullcontext()
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+def span(name, **attributes):
+    if tracer is None or not trace.get_current_span().get_span_context().is_valid:
+        return nullcontext()
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+def inject():
+    # Контекст текущей трассы для передачи через очередь или outbox; None, если трасса не выбрана
+    if tracer is None or not trace.get_current_span().get_span_context().is_valid:
+        return None
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def continue_span(name, carrier, **attributes):
+    # Продолжение трассы после очереди
+    if tracer is None or not carrier:
+        return nullcontext()
+    return tracer.start_as_current_span(name, context=propagate.extract(carrier), attributes=attributes)
+
+
+def linked_span(name, carriers, **attributes):
+    # Один спан на несколько трасс (пачка ЧП в одном POST) — через links
+    carriers = [carrier for carrier in carriers if carrier]
+    if tracer is None or not carriers:
+        return nullcontext()
+    links = [trace.Link(trace.get_current_span(propagate.extract(carrier)).get_span_context())
+             for carrier in carriers]
+    return tracer.start_as_current_span(name, links=links, attributes=attributes)
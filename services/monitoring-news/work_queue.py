@@ -0,0 +1,300 @@
+import asyncio
+import json
+import sqlite3
+import time
+
+# Очередь между чтением Telegram и анализом.
+# memory — asyncio.Queue внутри процесса, sqlite — файл на одной машине, rabbitmq — для нескольких воркеров.
+# Обработчик сообщения должен бросить исключение, чтобы задача ушла на повтор.
+
+
+class MemoryQueue:
+    # Не переживает перезапуск процесса, поэтому publish отдаёт future сохранения пачки:
+    # курсор канала двигают только после него
+    durable = False
+
+    def __init__(self, maxsize=50, max_attempts=5, retry_delay=30):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    async def connect(self):
+        pass
+
+    async def publish(self, payload):
+        done = asyncio.get_running_loop().create_future()
+        await self.queue.put((payload, 0, done))
+        return done
+
+    async def _retry(self, payload, attempts, done):
+        # Повтор с задержкой; task_done исходной задачи — после возврата в очередь, чтобы join её дождался
+        try:
+            await asyncio.sleep(self.retry_delay * 2 ** (attempts - 1))
+            await self.queue.put((payload, attempts, done))
+        finally:
+            self.queue.task_done()
+
+    async def _worker(self, handler):
+        while True:
+            payload, attempts, done = await self.queue.get()
+            try:
+                await handler(payload)
+            except Exception as e:
+                attempts += 1
+                print(f"Ошибка воркера анализа (попытка {attempts}/{self.max_attempts}): {e}")
+                if attempts < self.max_attempts:
+                    asyncio.create_task(self._retry(payload, attempts, done))
+                    continue
+                if not done.done():
+                    done.set_exception(e)
+            else:
+                if not done.done():
+                    done.set_result(None)
+            self.queue.task_done()
+
+    async def consume(self, handler, concurrency):
+        await asyncio.gather(*(self._worker(handler) for _ in range(concurrency)))
+
+    async def join(self):
+        await self.queue.join()
+
+    async def depth(self):
+        return self.queue.qsize()
+
+    async def close(self):
+        pass
+
+
+class SQLiteQueue:
+    durable = True
+
+    def __init__(self, path="news_queue.db", max_attempts=5, retry_delay=30, visibility_timeout=600,
+                 poll_interval=1.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _run(self, statements):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = statements(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    async def connect(self):
+        def create(conn):
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    locked_until REAL NULL,
+                    last_error TEXT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_jobs (
+                    id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT NULL,
+                    failed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_available_idx ON jobs (available_at)")
+        await asyncio.to_thread(self._run, create)
+
+    async def publish(self, payload):
+        body = json.dumps(payload, ensure_ascii=False)
+        await asyncio.to_thread(self._run, lambda conn: conn.execute(
+            "INSERT INTO jobs (payload, available_at) VALUES (?, ?)", (body, time.time())
+        ))
+
+    def _claim(self):
+        # Блокировка с таймаутом: задачу упавшего воркера заберёт другой
+        now = time.time()
+        return self._run(lambda conn: conn.execute("""
+            UPDATE jobs SET locked_until = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE available_at <= ? AND (locked_until IS NULL OR locked_until < ?)
+                ORDER BY id LIMIT 1
+            )
+            RETURNING id, payload, attempts
+        """, (now + self.visibility_timeout, now, now)).fetchone())
+
+    def _ack(self, job_id):
+        self._run(lambda conn: conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,)))
+
+    def _fail(self, job_id, payload, attempts, error):
+        def fail(conn):
+            if attempts >= self.max_attempts:
+                conn.execute(
+                    "INSERT OR REPLACE INTO dead_jobs (id, payload, attempts, last_error, failed_at) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, payload, attempts, error, time.time())
+                )
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            else:
+                conn.execute(
+                    "UPDATE jobs SET attempts = ?, available_at = ?, locked_until = NULL, last_error = ? WHERE id = ?",
+                    (attempts, time.time() + self.retry_delay * 2 ** (attempts - 1), error, job_id)
+                )
+        self._run(fail)
+
+    async def _worker(self, handler):
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            job_id, payload, attempts = job
+            try:
+                await handler(json.loads(payload))
+            except Exception as e:
+                print(f"Задача {job_id} не обработана (попытка {attempts + 1}/{self.max_attempts}): {e}")
+                await asyncio.to_thread(self._fail, job_id, payload, attempts + 1, str(e))
+            else:
+                await asyncio.to_thread(self._ack, job_id)
+
+    async def consume(self, handler, concurrency):
+        await asyncio.gather(*(self._worker(handler) for _ in range(concurrency)))
+
+    async def join(self):
+        # Ждём только готовые и взятые в работу задачи; отложенные повторы не держат цикл
+        def ready(conn):
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE available_at <= ?", (time.time(),)).fetchone()[0]
+        while await asyncio.to_thread(self._run, ready):
+            await asyncio.sleep(self.poll_interval)
+
+    async def depth(self):
+        return await asyncio.to_thread(
+            self._run, lambda conn: conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        )
+
+    async def close(self):
+        pass
+
+
+class RabbitQueue:
+    durable = True
+
+    def __init__(self, host="localhost", port=5672, user="guest", password="guest", name="news.raw",
+                 max_attempts=5, retry_delay=30, prefetch=4):
+        self.params = {"host": host, "port": port, "login": user, "password": password}
+        self.name = name
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.prefetch = prefetch
+        self.connection = None
+
+    async def connect(self):
+        import aio_pika
+
+        self.aio_pika = aio_pika
+        self.connection = await aio_pika.connect_robust(**self.params)
+        self.channel = await self.connection.channel()
+        await self.channel.set_qos(prefetch_count=self.prefetch)
+
+        # Основная очередь -> dead-letter после max_attempts; повторы через отдельную очередь с TTL
+        dead_exchange = await self.channel.declare_exchange(
+            f"{self.name}.dlx", aio_pika.ExchangeType.DIRECT, durable=True
+        )
+        dead_queue = await self.channel.declare_queue(f"{self.name}.dead", durable=True)
+        await dead_queue.bind(dead_exchange, routing_key=self.name)
+        self.queue = await self.channel.declare_queue(self.name, durable=True, arguments={
+            "x-dead-letter-exchange": f"{self.name}.dlx",
+            "x-dead-letter-routing-key": self.name
+        })
+        await self.channel.declare_queue(f"{self.name}.retry", durable=True, arguments={
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": self.name
+        })
+
+    async def _publish(self, body, routing_key, attempts=0, expiration=None):
+        await self.channel.default_exchange.publish(
+            self.aio_pika.Message(
+                body=body,
+                content_type="application/json",
+                delivery_mode=self.aio_pika.DeliveryMode.PERSISTENT,
+                headers={"x-attempts": attempts},
+                expiration=expiration
+            ),
+            routing_key=routing_key
+        )
+
+    async def publish(self, payload):
+        await self._publish(json.dumps(payload, ensure_ascii=False).encode("utf-8"), self.name)
+
+    async def consume(self, handler, concurrency):
+        await self.channel.set_qos(prefetch_count=concurrency)
+
+        async def on_message(message):
+            attempts = int((message.headers or {}).get("x-attempts", 0)) + 1
+            try:
+                await handler(json.loads(message.body))
+            except Exception as e:
+                print(f"Сообщение не обработано (попытка {attempts}/{self.max_attempts}): {e}")
+                if attempts >= self.max_attempts:
+                    await message.reject(requeue=False)
+                else:
+                    await self._publish(message.body, f"{self.name}.retry", attempts,
+                                        expiration=self.retry_delay * 2 ** (attempts - 1))
+                    await message.ack()
+            else:
+                await message.ack()
+
+        await self.queue.consume(on_message)
+        await asyncio.Future()
+
+    async def join(self):
+        pass
+
+    async def depth(self):
+        declared = await self.channel.declare_queue(self.name, passive=True)
+        return declared.declaration_result.message_count
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+
+
+def create_queue(queue_config, rabbitmq_config, default_size=50, role="all"):
+    backend = queue_config.get("backend", "memory")
+    max_attempts = queue_config.get("max_attempts", 5)
+    retry_delay = queue_config.get("retry_delay", 30)
+    if backend == "memory" and role != "all":
+        # Очередь в памяти не видна другому процессу: ingest упрётся в размер очереди, worker ничего не получит
+        raise ValueError(f"Роль {role} требует очередь sqlite или rabbitmq, а не memory")
+    if backend == "sqlite":
+        return SQLiteQueue(
+            path=queue_config.get("sqlite_path", "news_queue.db"),
+            max_attempts=max_attempts,
+            retry_delay=retry_delay,
+            visibility_timeout=queue_config.get("visibility_timeout", 600)
+        )
+    if backend == "rabbitmq":
+        return RabbitQueue(
+            host=rabbitmq_config.get("host", "localhost"),
+            port=rabbitmq_config.get("port", 5672),
+            user=rabbitmq_config.get("user", "guest"),
+            password=rabbitmq_config.get("password", "guest"),
+            name=queue_config.get("name", "news.raw"),
+            max_attempts=max_attempts,
+            retry_delay=retry_delay
+        )
+    return MemoryQueue(maxsize=queue_config.get("size", default_size), max_attempts=max_attempts,
+                       retry_delay=retry_delay)